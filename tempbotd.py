@@ -124,20 +124,28 @@ def parse_slack_output(slack_rtm_output):
             if output and 'text' in output and AT_BOT in output['text']:
                 # return text after the @ mention, whitespace removed
                 return output['text'].split(AT_BOT)[1].strip().lower(), \
-                        output['channel']
+                        output['channel'], output.get('user', '')
 
-    return None, None
+    return None, None, None
+
+
+def is_text_mode(param):
+    return 'text' in param.command.split()[1:]
 
 
 class CommandHandler:
     def __init__(self):
+        help_text = "book date ip log ping plot time traffic weather\n" \
+                    "book <title>|cancel\n" \
+                    "ping [latency|sla [<n>s|m|h|d]|schedule]\n" \
+                    "traffic [heatmap|text]"
         self.chat = {
             "hey": "Siri!",
             "ok": "Google!",
             "hello": "World!",
             "do": "Sure...write some more code then i can do that!",
-            "help": "book date ip log ping plot time traffic weather",
-            "?": "book date ip log ping plot time traffic weather",
+            "help": help_text,
+            "?": help_text,
         }
         self.command = {
             "book": book.run,
@@ -151,7 +159,7 @@ class CommandHandler:
             "weather": self.weather,
         }
 
-    def run(self, command, channel):
+    def run(self, command, channel, user=''):
         response = 'no sensor'
         if temperature:
             tmpr = temperature.get_temperature()
@@ -168,7 +176,8 @@ class CommandHandler:
             if not command.startswith(key):
                 continue
             if self.command[key]:
-                param = tbd.command.Command(command=command, channel=channel)
+                param = tbd.command.Command(command=command, channel=channel,
+                                            user=user)
                 log.debug('param.files(%x): %s' % (id(param), param.files))
                 result = self.command[key](param)
                 log.debug('result.files: %s' % result.files)
@@ -195,7 +204,19 @@ class CommandHandler:
             param.message = 'traffic is not available'
             return param
 
-        traffic_files = pingservers.save_icmp_results()
+        if is_text_mode(param):
+            text = pingservers.text_icmp_results()
+            if text:
+                param.message = '```%s```' % text
+            else:
+                param.message = 'traffic is not available'
+            return param
+
+        args = param.command.split()[1:]
+        if args and args[0] == 'heatmap':
+            traffic_files = pingservers.save_icmp_heatmaps()
+        else:
+            traffic_files = pingservers.save_icmp_results()
         if traffic_files:
             log.debug('traffic_files: %s', traffic_files)
             param.files = traffic_files
@@ -205,13 +226,47 @@ class CommandHandler:
         return param
 
     def ping(self, param):
-        if pingservers:
-            param.message = pingservers.get_status_of_servers()
-        else:
+        if not pingservers:
             param.message = 'ping is not available'
+            return param
+
+        args = param.command.split()[1:]
+        if args and args[0] == 'latency':
+            seconds = 60*60
+            if len(args) > 1:
+                seconds = tbd.anyping.parse_period(args[1])
+            if seconds:
+                param.message = pingservers.get_latency_of_servers(seconds)
+            else:
+                param.message = 'ping latency [<n>s|m|h|d]'
+            return param
+
+        if args and args[0] == 'sla':
+            seconds = 7*24*60*60
+            if len(args) > 1:
+                seconds = tbd.anyping.parse_period(args[1])
+            if seconds:
+                param.message = pingservers.get_sla_of_servers(seconds)
+            else:
+                param.message = 'ping sla [<n>s|m|h|d]'
+            return param
+
+        if args and args[0] == 'schedule':
+            param.message = pingservers.get_icmp_schedule()
+            return param
+
+        param.message = pingservers.get_status_of_servers()
         return param
 
     def log(self, param):
+        if is_text_mode(param):
+            text = elog.text()
+            if text:
+                param.message = '```%s```' % text
+            else:
+                param.message = 'no event log'
+            return param
+
         log_file = elog.save(filename="/tmp/elog.png")
         if log_file:
             param.files = [(log_file, 'Event Log')]
@@ -241,7 +296,10 @@ class CommandHandler:
     def plot(self, param):
         if temperature:
             time, data = temperature.get_temp_time()
-            if len(time) > 2:
+            if len(time) > 2 and is_text_mode(param):
+                text = tbd.temperature.text_temperature(time, data)
+                param.message = '```%s```' % text
+            elif len(time) > 2:
                 pngfile = tbd.temperature.plot_temperature(
                     time, data, pngfile='/tmp/temp.png')
                 if pngfile:
@@ -260,7 +318,9 @@ if __name__ == "__main__":
     ch = CommandHandler()
 
     if pingservers:
-        PING_INTERVAL_TIMER = int(pingservers.interval/READ_WEBSOCKET_DELAY)
+        # each server has its own schedule within ping_min_interval
+        PING_INTERVAL_TIMER = int(pingservers.min_interval /
+                                  READ_WEBSOCKET_DELAY)
     else:
         PING_INTERVAL_TIMER = -1
 
@@ -270,11 +330,12 @@ if __name__ == "__main__":
         ping_timer = 1
         while True:
             try:
-                command, channel = parse_slack_output(slack_client.rtm_read())
+                command, channel, user = parse_slack_output(
+                    slack_client.rtm_read())
                 log.debug("got command(%s): %s" % (channel, command))
                 if command and channel:
                     elog.log('command')
-                    ch.run(command, channel)
+                    ch.run(command, channel, user)
 
                 time.sleep(READ_WEBSOCKET_DELAY)
             except (websocket.WebSocketConnectionClosedException,
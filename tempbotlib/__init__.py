@@ -1,9 +1,16 @@
 import tempbotlib.anyping
 import tempbotlib.book
+import tempbotlib.cache
 import tempbotlib.dnsping
 import tempbotlib.eventlogger
 import tempbotlib.getip
+import tempbotlib.histogram
 import tempbotlib.httping
 import tempbotlib.icmping
+import tempbotlib.render
+import tempbotlib.ringbuffer
+import tempbotlib.sla
+import tempbotlib.sparkline
+import tempbotlib.tcping
 import tempbotlib.temperature
 import tempbotlib.weather
@@ -3,25 +3,64 @@
 import os
 import json
 import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait
+from threading import RLock
 
 from . import dnsping as dp
+from . import histogram as hg
 from . import httping as hp
 from . import icmping as ip
+from . import render
+from . import sla
+from . import tcping as tp
 
 import logging
 log = logging.getLogger(__name__)
 
 
+# probed in one task for all servers of the type
+BATCHED_TYPES = ['DNS', 'TCP']
+
+
 class AnypingError(Exception):
     pass
 
 
+def probe_one(server):
+    """
+    [(result, RTT)] of one server, the RTT read in the probing thread
+    """
+    result = server.is_alive()
+    return [(result, server.rtt)]
+
+
+def probe_batch(probe_servers, servers, timeout):
+    """
+    [(result, RTT)] of servers probed together
+    """
+    rtts = []
+    results = probe_servers(servers, timeout=timeout, rtts=rtts)
+    return list(zip(results, rtts))
+
+
+def parse_period(text):
+    """
+    '90s', '30m', '12h', '7d' to seconds. None if it cannot be parsed
+    """
+    units = {'s': 1, 'm': 60, 'h': 60*60, 'd': 24*60*60}
+    if len(text) < 2 or text[-1] not in units or not text[:-1].isdigit():
+        return None
+    return int(text[:-1]) * units[text[-1]]
+
+
 class Servers():
     """
     ping some servers
     """
     def __init__(self):
         self.icmp_servers = []
+        self.icmp_pinger = None
 
         self.ANYPING_CONFIG = os.environ.get("ANYPING_CONFIG")
         if not self.ANYPING_CONFIG:
@@ -62,22 +101,101 @@ class Servers():
             raise AnypingError("'alert_delay' is not 'int'")
         log.debug('alert_delay: %d times' % self.interval)
 
+        self.deadline = self.configuration.get('ping_deadline', 15)  # [sec]
+        if type(self.deadline) is not int:
+            raise AnypingError("'ping_deadline' is not 'int'")
+        log.debug('ping_deadline: %d sec' % self.deadline)
+
+        # the 'ping' command answers from results younger than this
+        self.freshness = self.configuration.get('ping_freshness',
+                                                self.interval)  # [sec]
+        if type(self.freshness) is not int:
+            raise AnypingError("'ping_freshness' is not 'int'")
+        log.debug('ping_freshness: %d sec' % self.freshness)
+        self.probe_lock = RLock()
+        self.events = ''  # messages for the next ping()
+
+        # per-server probe interval adapts between these bounds
+        self.min_interval = self.configuration.get('ping_min_interval',
+                                                   self.interval)  # [sec]
+        self.max_interval = self.configuration.get('ping_max_interval',
+                                                   self.interval)  # [sec]
+        if type(self.min_interval) is not int or \
+                type(self.max_interval) is not int:
+            raise AnypingError("'ping_min/max_interval' is not 'int'")
+        if not 0 < self.min_interval <= self.max_interval:
+            raise AnypingError("'ping_min/max_interval' is out of range")
+        log.debug('ping interval: %d - %d sec' %
+                  (self.min_interval, self.max_interval))
+
+        self.flap_window = self.configuration.get('flap_window',
+                                                  3600)  # [sec]
+        self.flap_threshold = self.configuration.get('flap_threshold', 5)
+        if type(self.flap_window) is not int or \
+                type(self.flap_threshold) is not int:
+            raise AnypingError("'flap_window/threshold' is not 'int'")
+        log.debug('flap: %d changes in %d sec' %
+                  (self.flap_threshold, self.flap_window))
+
+        latency_slot = self.configuration.get('latency_slot', 300)  # [sec]
+        latency_slots = self.configuration.get('latency_slots', 288)
+        if type(latency_slot) is not int or type(latency_slots) is not int:
+            raise AnypingError("'latency_slot(s)' is not 'int'")
+        log.debug('latency: %d sec x %d' % (latency_slot, latency_slots))
+
         for server in self.servers.keys():
             log.debug("server=%s" % server)
             prop = self.servers[server]
+            prop['latency'] = hg.LatencyHistogram(slot=latency_slot,
+                                                  slots=latency_slots)
+            prop['checked'] = None  # time.monotonic() of the last probe
+            # gaps longer than a missed probe are not counted as up or down
+            prop['sla'] = sla.Availability(
+                max_gap=2*self.max_interval + self.deadline)
+            if type(prop.get('alert_delay', self.alert_delay)) is not int:
+                raise AnypingError("'alert_delay' of '%s' is not 'int'"
+                                   % server)
             if prop['type'] == 'DNS':
                 prop['server'] = dp.Server(server, prop['hostname'])
             elif prop['type'] == 'Web':
-                prop['server'] = hp.Server(server)
+                prop['server'] = hp.Server(server,
+                                           method=prop.get('method', 'GET'))
+            elif prop['type'] == 'TCP':
+                try:
+                    prop['server'] = tp.Server(server)
+                except ValueError as e:
+                    raise AnypingError(e)
             else:
                 raise AnypingError("'type of '{0}' is unknown: {1}".format(
                     server, prop['type']))
-
-            alive, prop['message'] = prop['server'].is_alive()
+            # a probe gives up by itself before the deadline of the round
+            prop['server'].timeout = min(prop['server'].timeout,
+                                         self.deadline)
+
+        # one worker for each probe of a round: each server that is not
+        # batched, and one task for the DNS and one for the TCP servers.
+        # the probes end within their timeout, so a round does not wait
+        # for the probes of the last one
+        batched = [server for server in self.servers.keys()
+                   if self.servers[server]['type'] in BATCHED_TYPES]
+        batches = set(self.servers[server]['type'] for server in batched)
+        self.executor = ThreadPoolExecutor(
+            max_workers=len(self.servers) - len(batched) + len(batches),
+            thread_name_prefix='anyping')
+        results = self.probe()
+        now = time.monotonic()
+        for server in self.servers.keys():
+            prop = self.servers[server]
+            alive, prop['message'] = results[server]
             if alive:
-                prop['alive'] = self.alert_delay
+                prop['alive'] = prop.get('alert_delay', self.alert_delay)
             else:
                 prop['alive'] = 0
+            prop['up'] = alive
+            prop['transitions'] = deque()
+            prop['flapping'] = False
+            prop['interval'] = self.interval
+            prop['next'] = now
 
         icmp_sample_size = self.configuration.get('icmp_sample_size')
         if not icmp_sample_size:
@@ -97,61 +215,267 @@ class Servers():
         icmp_hosts = self.configuration.get('icmp_hosts', None)
         log.debug('icmp_hosts: %s ' % icmp_hosts)
 
+        # 'socket', 'subprocess' or 'auto'
+        icmp_engine = self.configuration.get('icmp_engine', 'auto')
+        log.debug('icmp_engine: %s ' % icmp_engine)
+
         self.icmp_file_prefix = self.configuration.get('icmp_file_prefix',
                                                        None)
         log.debug('icmp_file_prefix: %s ' % self.icmp_file_prefix)
 
+        # processes rendering the traffic graphs, 0 renders in this process
+        self.render_workers = self.configuration.get('icmp_render_workers',
+                                                     os.cpu_count() or 1)
+        if type(self.render_workers) is not int or self.render_workers < 0:
+            raise AnypingError("'icmp_render_workers' is not 'int'")
+        log.debug('icmp_render_workers: %d ' % self.render_workers)
+        self.renderer = None  # started on the first request
+        # filename: (number of samples it was rendered from, outfile)
+        self.icmp_graphs = {}
+
         for host in icmp_hosts:
             log.debug("icmp host=%s" % host)
             try:
                 ips = ip.Server(host=host, sample_count=icmp_sample_size,
                                 interval=icmp_interval,
-                                rotate=icmp_rotate)
+                                rotate=icmp_rotate, engine=icmp_engine)
             except Exception as e:
                 raise AnypingError(e)
             else:
                 self.icmp_servers.append(ips)
 
-        for icmp_server in self.icmp_servers:
-            icmp_server.start()
+        # seconds between the rounds of different hosts,
+        # None spreads them evenly over the interval
+        icmp_spacing = self.configuration.get('icmp_spacing', None)
+        log.debug('icmp_spacing: %s ' % icmp_spacing)
+
+        # random shift of each round as a fraction of a host's slot
+        icmp_jitter = self.configuration.get('icmp_jitter', 0.2)
+        if type(icmp_jitter) not in (int, float) or \
+                not 0 <= icmp_jitter <= 0.5:
+            raise AnypingError("'icmp_jitter' is not in 0 - 0.5")
+        log.debug('icmp_jitter: %f ' % icmp_jitter)
+
+        self.icmp_interval = icmp_interval
+        if self.icmp_servers and \
+                all(server.engine == 'socket' for server in self.icmp_servers):
+            # one thread and one socket for all hosts
+            self.icmp_pinger = ip.Pinger(self.icmp_servers,
+                                         interval=icmp_interval,
+                                         spacing=icmp_spacing)
+            self.icmp_pinger.jitter = icmp_jitter*self.icmp_pinger.spacing
+            self.icmp_pinger.start()
+        elif self.icmp_servers:
+            # hosts take turns over the interval instead of a burst
+            slot = icmp_interval / len(self.icmp_servers)
+            offsets = ip.phase_offsets(len(self.icmp_servers), icmp_interval)
+            for icmp_server, offset in zip(self.icmp_servers, offsets):
+                icmp_server.phase = offset
+                icmp_server.jitter = icmp_jitter*slot
+                icmp_server.start()
 
     def __del__(self):
+        if self.icmp_pinger:
+            self.icmp_pinger.finish()
         if self.icmp_servers:
             for server in self.icmp_servers:
                 server.finish()
-
-    def ping(self):
-        log.debug("ping()")
-        messages = ''
-        for server in self.servers.keys():
-            alive, message = self.servers[server]['server'].is_alive()
-            log.debug(
-                    "%s(%s:%d): %s" %
-                    (server, alive, self.servers[server]['alive'], message)
-                )
+        if getattr(self, 'executor', None):
+            self.executor.shutdown(wait=False)
+        if getattr(self, 'renderer', None):
+            self.renderer.close()
+
+    def probe(self, servers=None):
+        """
+        probe servers concurrently until the deadline of the round
+        """
+        log.debug("probe(%s)" % servers)
+        if servers is None:
+            servers = list(self.servers.keys())
+        with self.probe_lock:
+            results = self.probe_round(servers)
+            now = time.monotonic()
+            wallclock = time.time()
+            for server in results:
+                self.servers[server]['status'] = results[server]
+                self.servers[server]['checked'] = now
+                self.servers[server]['sla'].record(results[server][0],
+                                                   wallclock)
+                if 'up' in self.servers[server]:
+                    # the probes of the 'ping' command count as well
+                    self.events += self.transition(server, results[server],
+                                                   now)
+        log.debug("exit probe()")
+        return results
+
+    def cached_probe(self, freshness=None):
+        """
+        results of the last round, probing again only if they are stale.
+        callers arriving during a round wait for it and share its results
+        """
+        log.debug("cached_probe(freshness=%s)" % freshness)
+        if freshness is None:
+            freshness = self.freshness
+        arrived = time.monotonic()
+        with self.probe_lock:
+            stale = []
+            for server in self.servers.keys():
+                checked = self.servers[server]['checked']
+                if checked is None or (checked < arrived and
+                                       arrived - checked > freshness):
+                    stale.append(server)
+            if stale:
+                self.probe(stale)
+            results = {}
+            for server in self.servers.keys():
+                results[server] = self.servers[server]['status']
+            age = time.monotonic() - min(
+                self.servers[server]['checked'] for server in results)
+        log.debug("exit cached_probe(): %.1f sec ago" % age)
+        return results, age
+
+    def probe_round(self, servers):
+        jobs = []
+        batches = dict((server_type, []) for server_type in BATCHED_TYPES)
+        for server in servers:
             server_type = self.servers[server]['type']
+            if server_type in batches:
+                batches[server_type].append(server)
+                continue
+            future = self.executor.submit(
+                probe_one, self.servers[server]['server'])
+            jobs.append(([server], future))
+        # all DNS queries share one socket and all TCP connects one event
+        # loop in a single task per type
+        for probe_servers, batch in [(dp.probe_servers, batches['DNS']),
+                                     (tp.probe_servers, batches['TCP'])]:
+            if batch:
+                batch_servers = [self.servers[server]['server']
+                                 for server in batch]
+                future = self.executor.submit(
+                    probe_batch, probe_servers, batch_servers,
+                    max(s.timeout for s in batch_servers))
+                jobs.append((batch, future))
+
+        t1 = time.monotonic()
+        done, not_done = wait([future for _, future in jobs],
+                              timeout=self.deadline)
+        log.debug("probe round: %.3f sec (%d not done)" %
+                  (time.monotonic() - t1, len(not_done)))
+
+        results = {}
+        for servers, future in jobs:
+            if future in not_done:
+                future.cancel()
+                for server in servers:
+                    results[server] = (False, 'Probe deadline exceeded')
+                continue
+            try:
+                answers = future.result()
+            except Exception as e:
+                log.warning("%s: %s" % (servers, e))
+                for server in servers:
+                    results[server] = (False, str(e))
+                continue
+            # the RTT of this round, not the attribute a late probe writes
+            for server, (result, rtt) in zip(servers, answers):
+                results[server] = result
+                if rtt is not None:
+                    self.servers[server]['latency'].record(rtt)
+
+        return results
+
+    def schedule(self, server, alive, now):
+        """
+        adapt the probe interval of the server and detect flapping.
+        returns a flapping message or ''
+        """
+        prop = self.servers[server]
+        if alive != prop['up']:
+            prop['up'] = alive
+            prop['transitions'].append(now)
+        while prop['transitions'] and \
+                now - prop['transitions'][0] > self.flap_window:
+            prop['transitions'].popleft()
+        changes = len(prop['transitions'])
+
+        # back off while stable, probe faster while failing or recovered
+        if not alive or (changes and prop['transitions'][-1] == now):
+            prop['interval'] = self.min_interval
+        else:
+            prop['interval'] = min(prop['interval']*2, self.max_interval)
+        prop['next'] = now + prop['interval']
+        log.debug("%s: next probe in %d sec (%d changes)" %
+                  (server, prop['interval'], changes))
+
+        message = ''
+        if not prop['flapping'] and changes >= self.flap_threshold:
+            prop['flapping'] = True
+            message = "{0} is flapping: {1} changes in {2} min\n".format(
+                server, changes, self.flap_window // 60)
+        elif prop['flapping'] and changes <= self.flap_threshold // 2:
+            prop['flapping'] = False
             if alive:
-                if self.servers[server]['alive'] <= 0:
-                    messages += "{0} is up\n".format(server)
-                self.servers[server]['alive'] = self.alert_delay
+                message = "{0} stopped flapping: up\n".format(server)
             else:
-                if self.servers[server]['alive'] >= 0:
-                    self.servers[server]['alive'] -= 1
+                message = "{0} stopped flapping: down\n".format(server)
+        return message
+
+    def transition(self, server, result, now):
+        """
+        count the result toward the up/down alert and the schedule of the
+        server. returns the messages of the alert or flapping
+        """
+        prop = self.servers[server]
+        alive, message = result
+        log.debug("%s(%s:%d): %s" % (server, alive, prop['alive'], message))
+        server_type = prop['type']
+        event = ''
+        if alive:
+            if prop['alive'] <= 0:
+                event = "{0} is up\n".format(server)
+            prop['alive'] = prop.get('alert_delay', self.alert_delay)
+        else:
+            if prop['alive'] >= 0:
+                prop['alive'] -= 1
 
-                if self.servers[server]['alive'] == 0:
-                    messages += "{0} ({1}) is down: {2}\n".format(
-                        server, server_type, message)
+            if prop['alive'] == 0:
+                event = "{0} ({1}) is down: {2}\n".format(
+                    server, server_type, message)
 
-            self.servers[server]['message'] = message
+        prop['message'] = message
+        flapping = self.schedule(server, alive, now)
+        if flapping:
+            return flapping
+        if not prop['flapping']:
+            return event
+        return ''
 
+    def ping(self):
+        """
+        probe the servers that are due. returns the messages of these and
+        of the probes for the 'ping' command since the last call
+        """
+        log.debug("ping()")
+        now = time.monotonic()
+        due = [server for server in self.servers.keys()
+               if self.servers[server]['next'] <= now]
+        if due:
+            self.probe(due)
+        else:
+            log.debug("no server to probe")
+
+        with self.probe_lock:
+            messages, self.events = self.events, ''
         log.debug("messages: %s" % (messages))
         return messages
 
-    def get_status_of_servers(self):
-        log.debug("get_status_of_servers()")
+    def get_status_of_servers(self, freshness=None):
+        log.debug("get_status_of_servers(freshness=%s)" % freshness)
         messages = ''
+        results, age = self.cached_probe(freshness)
         for server in self.servers.keys():
-            alive, message = self.servers[server]['server'].is_alive()
+            alive, message = results[server]
             log.debug("%s(%s): %s" % (server, alive, message))
             server_type = self.servers[server]['type']
             if alive:
@@ -162,31 +486,202 @@ class Servers():
 
             self.servers[server]['message'] = message
 
+        messages += "(checked %d sec ago)\n" % age
         log.debug("exit get_status_of_servers()")
         return messages
 
     def save_icmp_results(self):
         log.debug("save_icmp_results()")
         outfiles = []
-        if self.icmp_servers:
-            if self.icmp_file_prefix:
+        if self.icmp_file_prefix:
+            if self.icmp_servers:
+                graphs = []
+                jobs = []
                 filename = "%s_all.png" % (self.icmp_file_prefix)
-                if ip.save_results(self.icmp_servers, filename=filename):
-                    outfiles.append((filename, "all"))
+                graphs.append((filename, "all"))
+                samples = tuple(s.results.written for s in self.icmp_servers)
+                if self.is_graph_stale(filename, samples):
+                    snapshots = ip.snapshot_results(self.icmp_servers)
+                    if snapshots:
+                        jobs.append((filename, samples, ip.plot_all,
+                                     (snapshots, filename)))
+                    else:
+                        self.icmp_graphs[filename] = (samples, None)
                 n = 0
                 for server in self.icmp_servers:
                     filename = "%s_%d.png" % (self.icmp_file_prefix, n)
-                    if server.save(filename=filename):
-                        outfiles.append((filename, server.host))
+                    graphs.append((filename, server.host))
                     n += 1
+                    samples = server.results.written
+                    if not self.is_graph_stale(filename, samples):
+                        continue
+                    results_len = server.results.count('avg')
+                    if results_len < 2:
+                        log.info('skip traffic plot because %s has too few '
+                                 'data(%d)' % (server.host, results_len))
+                        self.icmp_graphs[filename] = (samples, None)
+                        continue
+                    jobs.append((filename, samples, ip.plot_results,
+                                 (server.host, server.snapshot(), filename)))
+
+                self.render_graphs(jobs)
+                for filename, name in graphs:
+                    if self.icmp_graphs[filename][1]:
+                        outfiles.append((filename, name))
             else:
-                log.warning("no icmp_file_prefix")
+                log.warning("no icmp hosts")
+
+            filename = "%s_latency.png" % (self.icmp_file_prefix)
+            histograms = {}
+            for server in self.servers:
+                histograms[server] = self.servers[server]['latency']
+            if hg.save_histograms(histograms, filename=filename):
+                outfiles.append((filename, "latency"))
         else:
-            log.warning("no icmp hosts")
+            log.warning("no icmp_file_prefix")
 
         log.debug("exit save_icmp_results()")
         return outfiles
 
+    def save_icmp_heatmaps(self):
+        log.debug("save_icmp_heatmaps()")
+        outfiles = []
+        if not self.icmp_file_prefix:
+            log.warning("no icmp_file_prefix")
+            return outfiles
+        if not self.icmp_servers:
+            log.warning("no icmp hosts")
+            return outfiles
+
+        graphs = []
+        jobs = []
+        n = 0
+        for server in self.icmp_servers:
+            filename = "%s_%d_heatmap.png" % (self.icmp_file_prefix, n)
+            graphs.append((filename, server.host))
+            n += 1
+            samples = server.results.written
+            if not self.is_graph_stale(filename, samples):
+                continue
+            if len(server.results) < 2:
+                log.info('skip heatmap because %s has too few data(%d)' %
+                         (server.host, len(server.results)))
+                self.icmp_graphs[filename] = (samples, None)
+                continue
+            jobs.append((filename, samples, ip.plot_heatmap,
+                         (server.host, server.snapshot(ip.HEATMAP_COLUMNS),
+                          filename)))
+
+        self.render_graphs(jobs)
+        for filename, name in graphs:
+            if self.icmp_graphs[filename][1]:
+                outfiles.append((filename, name))
+
+        log.debug("exit save_icmp_heatmaps()")
+        return outfiles
+
+    def is_graph_stale(self, filename, samples):
+        cached = self.icmp_graphs.get(filename)
+        if cached and cached[0] == samples and \
+                (cached[1] is None or os.path.isfile(cached[1])):
+            log.debug("%s is up to date" % filename)
+            return False
+        return True
+
+    def render_graphs(self, jobs):
+        """
+        render graphs in the worker processes and remember them.
+        jobs: [(filename, samples, function, args)]
+        """
+        log.debug("render_graphs(%d jobs)" % len(jobs))
+        if len(jobs) > 1 and self.render_workers > 1:
+            if not self.renderer:
+                self.renderer = render.Renderer(self.render_workers)
+            outputs = self.renderer.map(
+                [(function, args) for filename, samples, function, args
+                 in jobs])
+        else:
+            outputs = [function(*args)
+                       for filename, samples, function, args in jobs]
+
+        for (filename, samples, function, args), outfile in \
+                zip(jobs, outputs):
+            self.icmp_graphs[filename] = (samples, outfile)
+        log.debug("exit render_graphs()")
+
+    def get_icmp_schedule(self):
+        log.debug("get_icmp_schedule()")
+        if not self.icmp_servers:
+            return "no icmp hosts\n"
+
+        messages = ''
+        now = time.monotonic()
+        for server in self.icmp_servers:
+            if server.round_start is None:
+                messages += "{0} not pinged yet\n".format(server.host)
+                continue
+            messages += "{0} +{1:.1f} sec ({2:.0f} sec ago)\n".format(
+                server.host, server.round_start % self.icmp_interval,
+                now - server.round_start)
+
+        spread = ip.schedule_spread(self.icmp_servers, self.icmp_interval)
+        if spread is not None:
+            messages += "spread: {0:.1f} sec min gap " \
+                        "(even {1:.1f} sec)\n".format(
+                            spread, self.icmp_interval/len(self.icmp_servers))
+        log.debug("exit get_icmp_schedule()")
+        return messages
+
+    def get_sla_of_servers(self, seconds=7*24*60*60):
+        log.debug("get_sla_of_servers(seconds=%d)" % seconds)
+        messages = ''
+        now = time.time()
+        for server in self.servers.keys():
+            server_type = self.servers[server]['type']
+            availability = self.servers[server]['sla']
+            percent, up, down, outages = availability.report(seconds, now)
+            if percent is None:
+                messages += "{0} ({1}) no samples\n".format(
+                    server, server_type)
+                continue
+            messages += "{0} ({1}) {2:.3f}% up, {3} outages, down {4} " \
+                        "of {5}".format(server, server_type, percent,
+                                        outages, sla.format_duration(down),
+                                        sla.format_duration(up + down))
+            if availability.down_since is not None:
+                messages += ", down for {0} now".format(
+                    sla.format_duration(now - availability.down_since))
+            messages += "\n"
+
+        log.debug("exit get_sla_of_servers()")
+        return messages
+
+    def get_latency_of_servers(self, seconds=3600):
+        log.debug("get_latency_of_servers(seconds=%d)" % seconds)
+        messages = ''
+        for server in self.servers.keys():
+            server_type = self.servers[server]['type']
+            (p50, p95, p99), n = \
+                self.servers[server]['latency'].percentiles(seconds=seconds)
+            if n == 0:
+                messages += "{0} ({1}) no samples\n".format(
+                    server, server_type)
+                continue
+            messages += "{0} ({1}) p50 {2:.1f} p95 {3:.1f} p99 {4:.1f} ms " \
+                        "({5} samples)\n".format(
+                            server, server_type, p50, p95, p99, n)
+
+        log.debug("exit get_latency_of_servers()")
+        return messages
+
+    def text_icmp_results(self, width=60):
+        log.debug("text_icmp_results(width=%d)" % width)
+        if not self.icmp_servers:
+            log.warning("no icmp hosts")
+            return None
+
+        return ip.text_results(self.icmp_servers, width=width)
+
 
 def main():
     servers = Servers()
@@ -3,12 +3,18 @@
 import time
 import re
 import os
-from threading import Thread
+from collections import OrderedDict, deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from concurrent.futures import TimeoutError
+from threading import BoundedSemaphore, Event, Lock, Thread
+from threading import current_thread
+from urllib.parse import urlsplit
 import json
 import random
 import queue
 import bs4
 import requests
+from .cache import Cache, SingleFlight
 
 import logging
 log = logging.getLogger(__name__)
@@ -17,20 +23,93 @@ ZEN = "".join(chr(0xff01 + i) for i in range(94))
 HAN = "".join(chr(0x21 + i) for i in range(94))
 ZEN2HAN = str.maketrans(ZEN, HAN)
 
+# ISBN lookup of each source
+SOURCES = {'honto': 'get_isbn_h', 'calil': 'get_isbn_c'}
+
+try:
+    import lxml  # noqa: F401
+    PARSER = 'lxml'
+except ImportError:
+    PARSER = 'html.parser'
+
+ISBN10_PATTERN = re.compile(r'ISBN-10\D+(\d{9}[0-9Xx])\D*')
+ISBN_PATTERN = re.compile('ISBN')
+ISBN_TITLE_PATTERN = re.compile(r'^\d{10}$')
+# the least time-out [sec] of a calil.jp request near the deadline
+MIN_REQUEST_TIMEOUT = 0.1
+
+
+def normalize(book):
+    """
+    the same key for zenkaku/hankaku, case and spacing variants of a title
+    """
+    return ' '.join(book.translate(ZEN2HAN).lower().split())
+
+
+def parse_only(text, name, **attrs):
+    """
+    parse only the 'name' elements having attrs, the rest is skipped
+    """
+    return bs4.BeautifulSoup(text, features=PARSER,
+                             parse_only=bs4.SoupStrainer(name, **attrs))
+
+
+def poll_delays(initial, cap, factor=2.0):
+    """
+    initial, initial*factor, ... up to cap [sec]
+    """
+    delay = initial
+    while True:
+        yield min(delay, cap)
+        delay *= factor
+
+
+def isbn_key(isbn):
+    """
+    the 9 digits shared by ISBN-10 and ISBN-13 of the same book
+    """
+    digits = re.sub(r'[^0-9Xx]', '', isbn)
+    if len(digits) == 13 and digits.startswith('978'):
+        return digits[3:12]
+    return digits[:9]
+
 
 class BookStatusError(Exception):
     pass
 
 
+def job_user(param):
+    if not param:
+        return ''
+    return param.user or param.channel
+
+
+class Job:
+    """
+    a book search with its own cancellation. the result goes to every
+    waiter, searches of the same title wait for one job
+    """
+    def __init__(self, book, param=None, result_format='string'):
+        self.book = book
+        self.key = normalize(book)
+        self.user = job_user(param)
+        self.waiters = [(self.user, param, result_format)]
+        self.cancel = Event()
+
+
 class BookStatus:
     """
     check book's status in libraries
     """
     def __init__(self, q):
-        self.thread = None
         self.abort = False
-        self.searching = False
         self.messages = q
+        self.jobs = OrderedDict()  # user: deque of waiting jobs, next first
+        self.running = []
+        self.workers = []
+        self.inflight = {}  # normalized title: waiting or running job
+        self.jobs_lock = Lock()
+        self.status_flights = SingleFlight()
 
         self.CALIL_APPKEY = os.environ.get("CALIL_APPKEY")
         if not self.CALIL_APPKEY:
@@ -64,14 +143,238 @@ class BookStatus:
                                   % self.BOOK_CONFIG)
         log.debug('libraries: %s' % self.libraries)
 
+        # optional, 'book' only has libraries
+        search = conf.get('book_search', {})
+        self.fetch_workers = search.get('fetch_workers', 8)
+        self.fetch_per_host = search.get('fetch_per_host', 2)
+        self.fetch_deadline = search.get('fetch_deadline', 30)  # [sec]
+        for key in ['fetch_workers', 'fetch_per_host', 'fetch_deadline']:
+            if type(getattr(self, key)) is not int or getattr(self, key) < 1:
+                raise BookStatusError("'%s' is not positive 'int'" % key)
+        log.debug('fetch: %d workers, %d per host, %d sec' %
+                  (self.fetch_workers, self.fetch_per_host,
+                   self.fetch_deadline))
+        self.executor = ThreadPoolExecutor(max_workers=self.fetch_workers,
+                                           thread_name_prefix='book')
+
+        # searches running at once and waiting searches of each user
+        self.search_workers = search.get('search_workers', 2)
+        self.queue_per_user = search.get('queue_per_user', 3)
+        for key in ['search_workers', 'queue_per_user']:
+            if type(getattr(self, key)) is not int or getattr(self, key) < 1:
+                raise BookStatusError("'%s' is not positive 'int'" % key)
+        log.debug('search: %d workers, %d per user' %
+                  (self.search_workers, self.queue_per_user))
+        self.host_slots = {}
+        self.host_slots_lock = Lock()
+
+        # ISBN sources in order of preference, queried in parallel
+        self.sources = search.get('sources', ['honto', 'calil'])
+        if not self.sources or \
+                any(source not in SOURCES for source in self.sources):
+            raise BookStatusError("'sources' must be in %s"
+                                  % list(SOURCES.keys()))
+        # use the first preferred source that finds the book
+        self.first_answer = search.get('first_answer', False)
+        log.debug('sources: %s (first answer: %s)' %
+                  (self.sources, self.first_answer))
+        self.lookups = ThreadPoolExecutor(
+            max_workers=len(self.sources)*self.search_workers,
+            thread_name_prefix='book-lookup')
+
+        # cache lifetimes [sec] and sizes, the ISBNs are saved at most
+        # every 'isbn_cache_save_interval' sec (0: on every change)
+        self.isbn_cache_ttl = search.get('isbn_cache_ttl', 7*24*60*60)
+        self.status_cache_ttl = search.get('status_cache_ttl', 5*60)
+        self.isbn_cache_save_interval = search.get(
+            'isbn_cache_save_interval', 0)
+        for key in ['isbn_cache_ttl', 'status_cache_ttl']:
+            if type(getattr(self, key)) not in (int, float) or \
+                    getattr(self, key) <= 0:
+                raise BookStatusError("'%s' is not positive 'float'" % key)
+        if type(self.isbn_cache_save_interval) not in (int, float) or \
+                self.isbn_cache_save_interval < 0:
+            raise BookStatusError("'isbn_cache_save_interval' is not 'float'")
+        self.isbn_cache_size = search.get('isbn_cache_size', 1000)
+        self.status_cache_size = search.get('status_cache_size', 1000)
+        for key in ['isbn_cache_size', 'status_cache_size']:
+            if type(getattr(self, key)) is not int or getattr(self, key) < 1:
+                raise BookStatusError("'%s' is not positive 'int'" % key)
+        # normalized title: {isbn: title}, kept on disk if a path is given
+        self.isbn_cache = Cache(ttl=self.isbn_cache_ttl,
+                                max_entries=self.isbn_cache_size,
+                                path=search.get('isbn_cache'),
+                                save_interval=self.isbn_cache_save_interval)
+        # (isbn, systemid): status of the book in the library
+        self.status_cache = Cache(ttl=self.status_cache_ttl,
+                                  max_entries=self.status_cache_size)
+
+        # calil.jp session polls start short and grow to the cap
+        self.poll_initial = search.get('poll_initial', 0.5)  # [sec]
+        self.poll_max = search.get('poll_max', 2.0)  # [sec]
+        for key in ['poll_initial', 'poll_max']:
+            if type(getattr(self, key)) not in (int, float) or \
+                    getattr(self, key) <= 0:
+                raise BookStatusError("'%s' is not positive 'float'" % key)
+        # (time to result [sec], polls) of the recent checks
+        self.poll_stats = deque(maxlen=100)
+
     def __del__(self):
-        if self.thread:
-            self.abort = True
-            self.thread.join()
-            self.searching = False
-            self.thread = None
+        self.abort = True
+        for worker in list(getattr(self, 'workers', [])):
+            worker.join()
+        if getattr(self, 'executor', None):
+            self.executor.shutdown(wait=False)
+        if getattr(self, 'lookups', None):
+            self.lookups.shutdown(wait=False)
+        if getattr(self, 'isbn_cache', None):
+            self.isbn_cache.save()  # the changes within the save interval
+
+    def cancelled(self, cancel=None):
+        return self.abort or (cancel is not None and cancel.is_set())
+
+    def fetch(self, link, cancel=None, params=None, deadline=None):
+        host = urlsplit(link).hostname
+        with self.host_slots_lock:
+            if host not in self.host_slots:
+                self.host_slots[host] = BoundedSemaphore(self.fetch_per_host)
+            slot = self.host_slots[host]
+        with slot:
+            if self.cancelled(cancel):
+                return None
+            timeout = self.fetch_deadline
+            if deadline is not None:
+                timeout = max(deadline - time.monotonic(), 0.1)
+            return requests.get(link, params=params, timeout=timeout)
+
+    def fetch_pages(self, links, parse, deadline=None, cancel=None,
+                    params=None):
+        """
+        GET links concurrently, at most 'fetch_per_host' at a time for each
+        host, and parse(text) each page as it arrives.
+        parsed pages in the order of links, None on an error, abort or the
+        deadline
+        """
+        if deadline is None:
+            deadline = time.monotonic() + self.fetch_deadline
+        futures = {}
+        for n, link in enumerate(links):
+            future = self.executor.submit(self.fetch, link, cancel, params,
+                                          deadline)
+            futures[future] = (n, link)
+        pages = [None] * len(links)
+
+        not_done = set(futures)
+        try:
+            while not_done:
+                if self.cancelled(cancel):
+                    log.warning('abort fetch_pages()')
+                    return None
+                remain = deadline - time.monotonic()
+                if remain <= 0:
+                    log.warning('fetch_pages() time-out')
+                    return None
+                done, not_done = wait(not_done, timeout=min(remain, 0.5),
+                                      return_when=FIRST_COMPLETED)
+                for future in done:
+                    n, link = futures[future]
+                    try:
+                        res = future.result()
+                    except Exception as e:
+                        log.warning(e)
+                        return None
+                    if res is None:
+                        continue  # aborted
+                    if res.status_code != 200:
+                        log.warning('%s return %d' % (link, res.status_code))
+                        return None
+                    pages[n] = parse(res.text)
+        finally:
+            for future in not_done:
+                future.cancel()
+        if self.cancelled(cancel):
+            log.warning('abort fetch_pages()')
+            return None
+        return pages
+
+    def parse_isbn_c(self, text):
+        isbns = []
+        soup = parse_only(text, 'div', itemprop='description')
+        description = soup.find_all('div', itemprop='description')
+        for d in description:
+            for line in d.text.split('\n'):
+                result = ISBN10_PATTERN.match(line)
+                if result:
+                    isbns.append(result.group(1))
+        return isbns
+
+    def parse_isbn_h(self, text):
+        isbns = []
+        soup = parse_only(text, 'li')
+        lis = soup.find_all('li', string=ISBN_PATTERN)
+        for li in lis:
+            isbn_string = li.string.split(r'：')
+            if len(isbn_string) == 2:
+                isbn = isbn_string[1].split('-')
+                if len(isbn) == 5:
+                    isbn.pop(0)
+                isbns.append(''.join(isbn))
+        return isbns
+
+    def get_isbns(self, book, cancel=None):
+        """
+        query the sources in parallel and merge their ISBNs in the order of
+        preference. with 'first_answer' the first preferred source that
+        finds the book wins and the others are cancelled
+        """
+        log.debug('get_isbns(%s)' % book)
+        key = normalize(book)
+        isbns = self.isbn_cache.get(key)
+        if isbns:
+            log.debug('get_isbns(): cached %s' % isbns)
+            return dict(isbns)
+
+        lookups_done = Event()
+        futures = [self.lookups.submit(getattr(self, SOURCES[source]),
+                                       book, cancel=lookups_done)
+                   for source in self.sources]
+        answers = []
+        try:
+            for source, future in zip(self.sources, futures):
+                answer = None
+                while not self.cancelled(cancel):
+                    try:
+                        answer = future.result(timeout=0.5)
+                    except TimeoutError:
+                        continue
+                    except Exception as e:
+                        log.warning('%s: %s' % (source, e))
+                    break
+                log.debug('%s: %s' % (source, answer))
+                answers.append(answer)
+                if self.first_answer and answer:
+                    break
+        finally:
+            lookups_done.set()
+        if self.cancelled(cancel):
+            log.warning('abort get_isbns()')
+            return None
 
-    def get_isbn_c(self, book, max_count=5):
+        isbns = {}
+        keys = set()
+        for answer in answers:
+            for isbn, title in (answer or {}).items():
+                if isbn_key(isbn) not in keys:
+                    keys.add(isbn_key(isbn))
+                    isbns[isbn] = title
+
+        if isbns:
+            self.isbn_cache.put(key, isbns)
+        log.debug('get_isbns(): %s (cache: %s)' %
+                  (isbns, self.isbn_cache.stats()))
+        return isbns
+
+    def get_isbn_c(self, book, max_count=5, cancel=None):
         log.debug('get_isbn_c(%s, %d)' % (book, max_count))
         url = 'https://api.calil.jp/openurl'
         params = {
@@ -79,19 +382,18 @@ class BookStatus:
         }
         isbns = {}
         book_link = []
-        try:
-            res = requests.get(url, params=params)
-        except Exception as e:
-            log.warning(e)
+        # the search page and the detail pages share the deadline
+        deadline = time.monotonic() + self.fetch_deadline
+        pages = self.fetch_pages(
+            [url], lambda text: parse_only(text, 'div', class_='title'),
+            deadline=deadline, cancel=cancel, params=params)
+        if pages is None:
             return None
-        else:
-            if res.status_code != 200:
-                log.warning('%s return %d' % (url, res.status_code))
-                return None
 
-        soup = bs4.BeautifulSoup(res.text, features='html.parser')
+        soup = pages[0]
         title = soup.find_all('div', class_='title')
         book_han = book.translate(ZEN2HAN).lower().split()
+        is_isbn = ISBN_TITLE_PATTERN.match(book.translate(ZEN2HAN))
         for t in title:
             log.debug("%s (%s)" % (t.a.string.strip(), t.a['id']))
             if not t.a:
@@ -101,7 +403,7 @@ class BookStatus:
             t_han = t.a.string.strip().translate(ZEN2HAN).lower().split()
             t_han.append('')  # sentinel
             match = True
-            if not re.match(r'^\d{10}$', book.translate(ZEN2HAN)):  # not ISBN
+            if not is_isbn:
                 for b in book_han:
                     if t_han.pop(0) != b:
                         match = False
@@ -110,33 +412,20 @@ class BookStatus:
                 book_link.append((t.a.string.strip(),
                                  'https://calil.jp' + t.a.get('href')))
 
-        for title, link in book_link[:max_count]:
-            if self.abort:
-                log.warning('abort get_isbn_d()')
-                return None
-            try:
-                res = requests.get(link)
-            except Exception as e:
-                log.warning(e)
-                return None
-            else:
-                if res.status_code != 200:
-                    log.warning('%s return %d' % (link, res.status_code))
-                    return None
-
-            soup = bs4.BeautifulSoup(res.text, features='html.parser')
-            description = soup.find_all('div', itemprop='description')
-            for d in description:
-                for line in d.text.split('\n'):
-                    pattern = r'ISBN-10\D+(\d{9}[0-9Xx])\D*'
-                    result = re.match(pattern, line)
-                    if result:
-                        isbns[result.group(1)] = title
+        book_link = book_link[:max_count]
+        pages = self.fetch_pages([link for title, link in book_link],
+                                 self.parse_isbn_c, deadline=deadline,
+                                 cancel=cancel)
+        if pages is None:
+            return None
+        for (title, link), page in zip(book_link, pages):
+            for isbn in page:
+                isbns[isbn] = title
 
         log.debug('get_isbn_c(): %s' % isbns)
         return isbns
 
-    def get_isbn_h(self, book, max_count=5):
+    def get_isbn_h(self, book, max_count=5, cancel=None):
         log.debug('get_isbn_h(%s, %d)' % (book, max_count))
         url = 'https://honto.jp/netstore/search.html'
         params = {
@@ -146,25 +435,24 @@ class BookStatus:
         }
         isbns = {}
         book_link = []
-        try:
-            res = requests.get(url, params=params)
-        except Exception as e:
-            log.warning(e)
+        # the search page and the detail pages share the deadline
+        deadline = time.monotonic() + self.fetch_deadline
+        pages = self.fetch_pages(
+            [url], lambda text: parse_only(text, 'a', class_='dyTitle'),
+            deadline=deadline, cancel=cancel, params=params)
+        if pages is None:
             return None
-        else:
-            if res.status_code != 200:
-                log.warning('%s return %d' % (url, res.status_code))
-                return None
 
-        soup = bs4.BeautifulSoup(res.text, features='html.parser')
+        soup = pages[0]
         title = soup.find_all('a', class_='dyTitle')
         book_han = book.translate(ZEN2HAN).lower().split()
+        is_isbn = ISBN_TITLE_PATTERN.match(book.translate(ZEN2HAN))
         for t in title:
             log.debug("%s" % t)
             t_han = t.string.translate(ZEN2HAN).lower().split()
             t_han.append('')  # sentinel
             match = True
-            if not re.match(r'^\d{10}$', book.translate(ZEN2HAN)):  # not ISBN
+            if not is_isbn:
                 for b in book_han:
                     if t_han.pop(0) != b:
                         match = False
@@ -172,48 +460,86 @@ class BookStatus:
             if match:
                 book_link.append((t.string.translate(ZEN2HAN), t.get('href')))
 
-        for title, link in book_link[:max_count]:
-            if self.abort:
-                log.warning('abort get_isbn_h()')
-                return None
-            try:
-                res = requests.get(link)
-            except Exception as e:
-                log.warning(e)
-                return None
-            else:
-                if res.status_code != 200:
-                    log.warning('%s return %d' % (link, res.status_code))
-                    return None
-
-            soup = bs4.BeautifulSoup(res.text, features='html.parser')
-            lis = soup.find_all('li', text=re.compile('ISBN'))
-            for li in lis:
-                isbn_string = li.string.split(r'：')
-                if len(isbn_string) == 2:
-                    isbn = isbn_string[1].split('-')
-                    if len(isbn) == 5:
-                        isbn.pop(0)
-                    isbns[''.join(isbn)] = title
+        book_link = book_link[:max_count]
+        pages = self.fetch_pages([link for title, link in book_link],
+                                 self.parse_isbn_h, deadline=deadline,
+                                 cancel=cancel)
+        if pages is None:
+            return None
+        for (title, link), page in zip(book_link, pages):
+            for isbn in page:
+                isbns[isbn] = title
 
         log.debug('get_isbn_h(): %s' % isbns)
         return isbns
 
-    def get_book_status(self, isbns, systemids, timeout=60):
+    def get_book_status(self, isbns, systemids, timeout=60, cancel=None):
+        """
+        status of (isbn, systemid) pairs from the cache and calil.jp.
+        calil.jp checks every isbn in every library of a request, so the
+        isbns and libraries having a stale pair are checked again
+        """
         log.debug('get_book_status(%s, %s, %s)' %
                   (isbns, systemids, timeout))
+        books = {}
+        stale_isbns = []
+        stale_systemids = []
+        for isbn in isbns:
+            books[isbn] = {}
+            for systemid in systemids:
+                status = self.status_cache.get((isbn, systemid))
+                if status:
+                    books[isbn][systemid] = status
+                    continue
+                if isbn not in stale_isbns:
+                    stale_isbns.append(isbn)
+                if systemid not in stale_systemids:
+                    stale_systemids.append(systemid)
+
+        if not stale_isbns:
+            log.debug('get_book_status(): cached %s' % books)
+            return {'books': books, 'continue': 0}
+
+        # concurrent searches of the same isbns share one polling session
+        json_data = self.status_flights.do(
+            (tuple(stale_isbns), tuple(stale_systemids)),
+            lambda: self.check_book_status(stale_isbns, stale_systemids,
+                                           timeout, cancel),
+            cancel=cancel)
+        if not json_data:
+            return json_data
+
+        json_data = dict(json_data)  # shared with the other callers
+        for isbn in json_data['books']:
+            for systemid in json_data['books'][isbn]:
+                status = json_data['books'][isbn][systemid]
+                books.setdefault(isbn, {})[systemid] = status
+                if status['status'] in ('OK', 'Cache'):
+                    self.status_cache.put((isbn, systemid), status)
+        json_data['books'] = books
+        log.debug('get_book_status(): %s' % json_data)
+        return json_data
+
+    def check_book_status(self, isbns, systemids, timeout=60, cancel=None):
+        log.debug('check_book_status(%s, %s, %s)' %
+                  (isbns, systemids, timeout))
 
-        polling_interval = 2  # [sec]
         url = 'https://api.calil.jp/check'
         params = {
             'appkey': self.CALIL_APPKEY,
             'callback': 'no'
         }
-        params['isbn'] = ','.join(isbns.keys())
+        params['isbn'] = ','.join(isbns)
         params['systemid'] = ','.join(systemids)
 
+        start = time.monotonic()
+        deadline = start + timeout
         try:
-            res = requests.get(url, params=params)
+            res = requests.get(url, params=params, timeout=max(
+                deadline - time.monotonic(), MIN_REQUEST_TIMEOUT))
+        except requests.Timeout:
+            log.warning('calil.jp query time-out')
+            return []
         except Exception as e:
             log.warning(e)
             return []
@@ -223,24 +549,35 @@ class BookStatus:
             return []
 
         json_data = res.json()
-        timer = timeout/polling_interval
+        polls = 0
+        delays = poll_delays(self.poll_initial, self.poll_max)
+        if cancel is None:
+            cancel = Event()  # only to sleep
         while json_data['continue'] == 1:
-            if self.abort:
-                log.warning('abort get_book_status()')
+            if self.cancelled(cancel):
+                log.warning('abort check_book_status()')
                 return []
 
-            if timer <= 0:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
                 log.warning('calil.jp query time-out')
                 return []
-            timer -= 1
-            time.sleep(polling_interval)
+            cancel.wait(min(next(delays), remaining))
+            if self.cancelled(cancel):
+                log.warning('abort check_book_status()')
+                return []
+            polls += 1
             try:
                 params = {
                     'appkey': self.CALIL_APPKEY,
                     'session': json_data['session'],
                     'callback': 'no'
                 }
-                res = requests.get(url, params=params)
+                res = requests.get(url, params=params, timeout=max(
+                    deadline - time.monotonic(), MIN_REQUEST_TIMEOUT))
+            except requests.Timeout:
+                log.warning('calil.jp query time-out')
+                return []
             except Exception as e:
                 log.warning(e)
                 return []
@@ -251,48 +588,42 @@ class BookStatus:
                 else:
                     json_data = res.json()
 
-        log.debug('get_book_status(): %s' % json_data)
+        elapsed = time.monotonic() - start
+        self.poll_stats.append((elapsed, polls))
+        log.info('check_book_status(): %.2f sec, %d polls' % (elapsed, polls))
+        log.debug('check_book_status(): %s' % json_data)
         return json_data
 
-    def run_search(self, book, result_format, param):
+    def poll_summary(self):
+        stats = list(self.poll_stats)
+        if not stats:
+            return 'no checks'
+        return '%d checks, %.1f sec, %.1f polls on average' % (
+            len(stats), sum([t for t, polls in stats])/len(stats),
+            sum([polls for t, polls in stats])/len(stats))
+
+    def run_search(self, job):
+        book = job.book
         log.debug('run_search(%s)' % book)
         result = {'book': book, 'data': {}}
 
-        isbns = self.get_isbn_h(book)
-        if not isbns:
-            isbns = self.get_isbn_c(book)
-        if not isbns:
-            if result_format == 'json':
-                param.args['json'] = result
-            else:
-                param.message = self.result_by_string(result)
-            try:
-                self.messages.put_nowait(param)
-                log.debug('add queue: %s' % param.message)
-            except queue.Full as e:
-                log.warning("run_search(): %s" % e)
+        isbns = self.get_isbns(book, cancel=job.cancel)
+        if self.cancelled(job.cancel):
+            log.warning('abort run_search()')
+            return
 
-            self.searching = False
+        if not isbns:
+            self.reply(job, result, self.result_by_string(result))
             return
 
-        if self.abort:
+        book_status = self.get_book_status(isbns, self.libraries,
+                                           cancel=job.cancel)
+        if self.cancelled(job.cancel):
             log.warning('abort run_search()')
-            self.searching = False
             return
 
-        book_status = self.get_book_status(isbns, self.libraries)
         if not book_status:
-            if result_format == 'json':
-                param.args['json'] = result
-            else:
-                param.message = 'Search error :construction:'
-            try:
-                self.messages.put_nowait(param)
-                log.debug('add queue: %s' % param.message)
-            except queue.Full as e:
-                log.warning("run_search(): %s" % e)
-
-            self.searching = False
+            self.reply(job, result, 'Search error :construction:')
             return
 
         for isbn in book_status['books']:
@@ -311,42 +642,159 @@ class BookStatus:
                     library['status'] = {' -_-': 'Error'}
 
         log.debug('run_search(): %s' % result)
-        if result_format == 'json':
-            param.args['json'] = result
-        else:
-            param.message = self.result_by_string(result)
-        try:
-            self.messages.put_nowait(param)
-            log.debug('add queue: %s' % param.message)
-        except queue.Full as e:
-            log.warning("run_search(): %s" % e)
-
-        self.searching = False
+        self.reply(job, result, self.result_by_string(result))
         return
 
-    def search(self, book, param=None, result_format='string'):
-        if self.searching:
-            log.warning('already searching')
-            return False
-        self.thread = Thread(target=self.run_search,
-                             args=(book, result_format, param))
-        self.searching = True
-        self.thread.start()
+    def reply(self, job, result, message):
+        """
+        put the result to the queue once for every waiter of the job
+        """
+        with self.jobs_lock:
+            # no more waiters attach to the job from now on
+            if self.inflight.get(job.key) is job:
+                del self.inflight[job.key]
+            waiters = list(job.waiters)
+
+        for user, param, result_format in waiters:
+            if result_format == 'json':
+                param.args['json'] = result
+            else:
+                param.message = message
+            try:
+                self.messages.put_nowait(param)
+                log.debug('add queue: %s' % param.message)
+            except queue.Full as e:
+                log.warning("run_search(): %s" % e)
 
-        return True
+    @property
+    def searching(self):
+        return bool(self.jobs) or bool(self.running)
+
+    def waiting_jobs(self):
+        """
+        waiting jobs in the order they start, one user after another
+        """
+        order = []
+        queues = list(self.jobs.values())
+        for n in range(max([len(jobs) for jobs in queues] + [0])):
+            for jobs in queues:
+                if n < len(jobs):
+                    order.append(jobs[n])
+        return order
+
+    def position(self, job):
+        """
+        1 for the next job to start, 0 if it starts now, None if not waiting
+        """
+        with self.jobs_lock:
+            order = self.waiting_jobs()
+            if job not in order:
+                return None
+            idle = self.search_workers - len(self.running)
+            return max(order.index(job) + 1 - idle, 0)
+
+    def worker(self):
+        """
+        run waiting jobs, users take turns. exits when nothing is waiting
+        """
+        log.debug('worker()')
+        job = None
+        while True:
+            with self.jobs_lock:
+                if job:
+                    self.running.remove(job)
+                    if self.inflight.get(job.key) is job:
+                        del self.inflight[job.key]
+                if self.abort or not self.jobs:
+                    # leave while holding the lock, search() starts another
+                    self.workers.remove(current_thread())
+                    break
+                user, jobs = next(iter(self.jobs.items()))
+                job = jobs.popleft()
+                del self.jobs[user]
+                if jobs:
+                    self.jobs[user] = jobs  # to the end of the turn
+                self.running.append(job)
+            try:
+                self.run_search(job)
+            except Exception as e:
+                log.warning("run_search(): %s" % e)
+        log.debug('exit worker()')
+
+    def search(self, book, param=None, result_format='string'):
+        """
+        queue a search, or wait for the job searching the same title.
+        the job, or None if the user has too many waiting
+        """
+        job = Job(book, param=param, result_format=result_format)
+        with self.jobs_lock:
+            inflight = self.inflight.get(job.key)
+            if inflight:
+                log.debug('search(): join the search of %s' % inflight.book)
+                inflight.waiters += job.waiters
+                return inflight
+
+            jobs = self.jobs.setdefault(job.user, deque())
+            if len(jobs) >= self.queue_per_user:
+                log.warning('too many searches of %s' % job.user)
+                if not jobs:
+                    del self.jobs[job.user]
+                return None
+            jobs.append(job)
+            self.inflight[job.key] = job
+            if len(self.workers) < self.search_workers:
+                worker = Thread(target=self.worker)
+                self.workers.append(worker)
+                worker.start()
+
+        return job
+
+    def cancel(self, user):
+        """
+        stop waiting for the searches of the user. a job is cancelled when
+        nobody waits for it
+        """
+        count = 0
+        with self.jobs_lock:
+            for job in list(self.inflight.values()):
+                waiters = [w for w in job.waiters if w[0] != user]
+                if len(waiters) == len(job.waiters):
+                    continue
+                count += 1
+                job.waiters = waiters
+                if waiters:
+                    continue
+                job.cancel.set()
+                del self.inflight[job.key]
+                jobs = self.jobs.get(job.user)
+                if jobs and job in jobs:
+                    jobs.remove(job)
+                    if not jobs:
+                        del self.jobs[job.user]
+        return count
 
     def run(self, param):
         log.debug('command(): %s, %s' % (param.command, param.channel))
         cmd = param.command.strip()
         cmd = re.split('[ 　]', cmd, 1)
-        if len(cmd) == 2:
-            res = self.search(cmd[1], param=param)
-            if res:
-                param.message = '"%s"...' % cmd[1]
+        if len(cmd) == 2 and cmd[1] == 'cancel':
+            param.message = 'cancelled %d searches' % (
+                self.cancel(job_user(param)))
+        elif len(cmd) == 2:
+            job = self.search(cmd[1], param=param)
+            if not job:
+                param.message = 'sorry, too many of your searches are waiting'
             else:
-                param.message = 'sorry, busy with searching the other book'
+                position = self.position(job)
+                if position:
+                    param.message = '"%s"... (queue position %d)' % (
+                        cmd[1], position)
+                else:
+                    param.message = '"%s"...' % cmd[1]
         else:
-            param.message = 'book <title>'
+            param.message = 'book <title>|cancel\n' \
+                '(isbn cache: %s, calil: %s)' % (
+                    self.isbn_cache.stats(), self.poll_summary())
 
         log.debug('exit command(): %s' % param.message)
         return param
@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+
+import json
+import os
+import time
+from collections import OrderedDict
+from threading import Event, Lock
+
+import logging
+log = logging.getLogger(__name__)
+
+
+class Cache:
+    """
+    key-value cache with TTL and LRU eviction. saved as JSON if path
+    is given, so keys and values must be JSON types. put() saves at most
+    every 'save_interval' sec, save() writes the pending changes
+    """
+
+    def __init__(self, ttl, max_entries=1000, path=None, save_interval=0):
+        log.debug("__init__(ttl=%s, max_entries=%s, path=%s, "
+                  "save_interval=%s)" % (ttl, max_entries, path,
+                                         save_interval))
+        if type(ttl) not in (int, float) or ttl <= 0:
+            raise ValueError("'ttl' is not positive 'float'")
+        if type(max_entries) is not int or max_entries < 1:
+            raise ValueError("'max_entries' is not positive 'int'")
+        if type(save_interval) not in (int, float) or save_interval < 0:
+            raise ValueError("'save_interval' is not 'float' >= 0")
+        self.ttl = ttl  # [sec]
+        self.max_entries = max_entries
+        self.path = path
+        self.save_interval = save_interval  # [sec]
+        self.entries = OrderedDict()  # key: (time.time(), value), LRU first
+        self.lock = Lock()
+        self.hits = 0
+        self.misses = 0
+        # changes not saved yet, and the last snapshot taken to save
+        self.dirty = False
+        self.saved = None  # time.monotonic()
+        self.version = 0
+        self.save_lock = Lock()
+        self.saved_version = 0
+        self.load()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def load(self):
+        if not self.path or not os.path.isfile(self.path):
+            return
+        try:
+            with open(self.path) as f:
+                entries = json.load(f)
+        except Exception as e:
+            log.warning("cannot load cache '%s': %s" % (self.path, e))
+            return
+        now = time.time()
+        for key, t, value in entries:
+            if now - t < self.ttl:
+                self.entries[key] = (t, value)
+        log.debug("load(): %d entries" % len(self.entries))
+
+    def snapshot(self):
+        """
+        entries to save, taken with the lock held
+        """
+        self.dirty = False
+        self.saved = time.monotonic()
+        self.version += 1
+        return self.version, [(key, t, value)
+                              for key, (t, value) in self.entries.items()]
+
+    def save(self):
+        if not self.path:
+            return
+        with self.lock:
+            if not self.dirty:
+                return
+            version, entries = self.snapshot()
+        self.write(version, entries)
+
+    def write(self, version, entries):
+        """
+        write a snapshot without the cache lock, so get() and put() of the
+        other threads do not wait for the file. an older snapshot than the
+        one on the disk is dropped
+        """
+        with self.save_lock:
+            if version <= self.saved_version:
+                return
+            self.saved_version = version
+            self.dump(entries)
+
+    def dump(self, entries):
+        tmp = self.path + '.tmp'
+        try:
+            with open(tmp, 'w') as f:
+                json.dump(entries, f, ensure_ascii=False)
+            os.replace(tmp, self.path)
+        except Exception as e:
+            log.warning("cannot save cache '%s': %s" % (self.path, e))
+
+    def get(self, key, now=None):
+        """
+        value or None if missing or expired
+        """
+        if now is None:
+            now = time.time()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry and now - entry[0] < self.ttl:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry:
+                del self.entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, key, value, now=None):
+        if now is None:
+            now = time.time()
+        snapshot = None
+        with self.lock:
+            self.entries[key] = (now, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+            if self.path:
+                self.dirty = True
+                if self.saved is None or \
+                        time.monotonic() - self.saved >= self.save_interval:
+                    snapshot = self.snapshot()
+        if snapshot:
+            self.write(*snapshot)
+
+    def stats(self):
+        return "%d entries, %d hits, %d misses" % (
+            len(self.entries), self.hits, self.misses)
+
+
+class SingleFlight:
+    """
+    run a function once for concurrent calls with the same key. the other
+    callers wait for the running call and share its result
+    """
+
+    def __init__(self):
+        self.calls = {}  # key: the running call
+        self.lock = Lock()
+        self.shared = 0
+
+    def do(self, key, function, cancel=None):
+        """
+        function() or the result of the running call. None if cancel is
+        set while waiting. if the running call is cancelled, the waiting
+        callers run function() again
+        """
+        while True:
+            with self.lock:
+                call = self.calls.get(key)
+                if not call:
+                    call = {'done': Event(), 'cancel': cancel,
+                            'result': None, 'error': None}
+                    self.calls[key] = call
+                    break
+                self.shared += 1
+            while not call['done'].wait(0.5):
+                if cancel is not None and cancel.is_set():
+                    return None
+            if call['cancel'] is not None and call['cancel'].is_set():
+                continue
+            if call['error']:
+                raise call['error']
+            return call['result']
+
+        try:
+            call['result'] = function()
+        except Exception as e:
+            call['error'] = e
+            raise
+        finally:
+            with self.lock:
+                del self.calls[key]
+            call['done'].set()
+        return call['result']
@@ -8,9 +8,10 @@ class CommandStatusError(Exception):
 
 class Command:
     def __init__(self, command="", channel="",
-                 message="", files=[], args={}):
+                 message="", files=[], args={}, user=""):
         self.command = command
         self.channel = channel
+        self.user = user
         self.message = message
         self.files = files
         self.args = args
@@ -1,6 +1,12 @@
 #!/usr/bin/env python3
 
+import asyncio
+import random
+import socket
+import time
 import dns.flags
+import dns.message
+import dns.rcode
 import dns.rdatatype
 import dns.resolver
 import re
@@ -8,19 +14,28 @@ import logging
 log = logging.getLogger(__name__)
 
 
+RETRIES = 2  # queries sent again without an answer
+
+
 class Server:
-    def __init__(self, nameserver='8.8.8.8', hostname='www.google.com'):
+    def __init__(self, nameserver='8.8.8.8', hostname='www.google.com',
+                 port=53):
         self.resolver = dns.resolver.Resolver()
         self.resolver.nameservers = [nameserver]
-        self.resolver.timeout = 5.0
-        self.resolver.lifetime = 10.0
+        self.resolver.port = port
+        self.timeout = 5.0  # [sec] for an answer
+        self.nameserver = nameserver
+        self.port = port
         self.hostname = hostname
+        self.rtt = None  # [ms] of the last response
         self.re_addr = re.compile(
             r'^(?:(?:[1-9]?\d|1\d\d|2[0-4]\d|25[0-5])\.){3}'
             r'(?:[1-9]?\d|1\d\d|2[0-4]\d|25[0-5])$')
 
     def is_alive(self):
-        answer = self.ping()
+        return self.check(self.ping())
+
+    def check(self, answer):
         if self.re_addr.search(answer):
             alive = True
         else:
@@ -29,6 +44,11 @@ class Server:
 
     def ping(self):
         answer = 'None'
+        self.rtt = None
+        # sent again to the same nameserver within the lifetime
+        self.resolver.timeout = self.timeout/(RETRIES + 1)
+        self.resolver.lifetime = self.timeout
+        t1 = time.monotonic()
         try:
             answers = self.resolver.query(
                 self.hostname, 'A', raise_on_no_answer=False)
@@ -36,11 +56,14 @@ class Server:
             answer = "No response to dns request"
         except dns.resolver.NXDOMAIN:
             answer = "Hostname does not exist"
+            self.rtt = (time.monotonic() - t1)*1000.0
         except dns.resolver.Timeout:
             answer = 'Request Timeout'
         except dns.resolver.NoAnswer:
             answer = 'No answer'
+            self.rtt = (time.monotonic() - t1)*1000.0
         else:
+            self.rtt = (time.monotonic() - t1)*1000.0
             if len(answers) < 1:
                 answer = 'No record'
             else:
@@ -48,9 +71,134 @@ class Server:
 
         return answer
 
+    def make_query(self, query_id):
+        query = dns.message.make_query(self.hostname, 'A')
+        query.id = query_id
+        return query
+
+    def answer_from(self, response):
+        """
+        same answer strings as ping() from a raw response message
+        """
+        rcode = response.rcode()
+        if rcode == dns.rcode.NXDOMAIN:
+            return "Hostname does not exist"
+        if rcode != dns.rcode.NOERROR:
+            return "No response to dns request"
+        for rrset in response.answer:
+            if rrset.rdtype == dns.rdatatype.A and len(rrset) > 0:
+                return str(rrset[0])
+        return 'No record'
+
+
+class _ProbeProtocol(asyncio.DatagramProtocol):
+    """
+    dispatch replies on the shared socket to the waiting queries by ID
+    """
+    def __init__(self, pending):
+        self.pending = pending
+
+    def datagram_received(self, data, addr):
+        try:
+            response = dns.message.from_wire(data)
+        except Exception as e:
+            log.debug("broken response from %s: %s" % (addr[0], e))
+            return
+
+        entry = self.pending.get(response.id)
+        if not entry:
+            log.debug("unexpected response id %d from %s" %
+                      (response.id, addr[0]))
+            return
+        server, query, t1, future = entry
+        if addr[0] != server.nameserver or not query.is_response(response):
+            log.debug("mismatched response id %d from %s" %
+                      (response.id, addr[0]))
+            return
+
+        del self.pending[response.id]
+        if not future.done():
+            future.set_result(((time.monotonic() - t1)*1000.0, response))
+
+
+async def probe(servers, timeout=5.0, tries=RETRIES + 1, rtts=None):
+    """
+    query all servers over one socket per address family. unanswered
+    queries are sent again with the same ID every timeout/tries.
+    'rtts' gets the RTT [ms] of each server, None without one
+    """
+    log.debug("probe(%d servers, timeout=%.1f)" % (len(servers), timeout))
+    loop = asyncio.get_running_loop()
+    pending = {}
+    transports = {}
+    queries = []  # (query ID, transport, wire, address)
+    futures = []
+    resent = set()
+    query_ids = random.sample(range(65536), len(servers))
+    deadline = loop.time() + timeout
+    try:
+        for server, query_id in zip(servers, query_ids):
+            family = socket.AF_INET6 if ':' in server.nameserver \
+                else socket.AF_INET
+            if family not in transports:
+                transports[family], _ = await loop.create_datagram_endpoint(
+                    lambda: _ProbeProtocol(pending), family=family)
+            query = server.make_query(query_id)
+            future = loop.create_future()
+            pending[query_id] = (server, query, time.monotonic(), future)
+            queries.append((query_id, transports[family], query.to_wire(),
+                            (server.nameserver, server.port)))
+            futures.append(future)
+
+        for attempt in range(tries):
+            for query_id, transport, wire, address in queries:
+                if query_id not in pending:
+                    continue  # answered
+                if attempt:
+                    resent.add(query_id)
+                transport.sendto(wire, address)
+            remain = deadline - loop.time()
+            if remain <= 0:
+                break
+            waiting = [future for future in futures if not future.done()]
+            if not waiting:
+                break
+            if attempt < tries - 1:
+                remain = min(remain, timeout/tries)
+            await asyncio.wait(waiting, timeout=remain)
+    finally:
+        for transport in transports.values():
+            transport.close()
+
+    results = []
+    for server, query_id, future in zip(servers, query_ids, futures):
+        if not future.done():
+            future.cancel()
+            server.rtt = None
+            results.append(server.check('Request Timeout'))
+            continue
+        rtt, response = future.result()
+        # the reply of a resent query may answer the first one
+        server.rtt = None if query_id in resent else rtt
+        if response.flags & dns.flags.TC:
+            # the server answered, the records did not fit in UDP
+            results.append((True, 'Truncated response'))
+        else:
+            results.append(server.check(server.answer_from(response)))
+
+    if rtts is not None:
+        rtts[:] = [server.rtt for server in servers]
+    log.debug("exit probe()")
+    return results
+
+
+def probe_servers(servers, timeout=5.0, rtts=None):
+    return asyncio.run(probe(servers, timeout=timeout, rtts=rtts))
+
 
 if __name__ == '__main__':
     dnsserver = Server(nameserver='8.8.8.8', hostname='www.google.com')
     answer = dnsserver.ping()
     print(answer)
     print(dnsserver.is_alive())
+    print(probe_servers([dnsserver, Server('1.1.1.1', 'www.example.com')]))
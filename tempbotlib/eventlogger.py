@@ -1,6 +1,8 @@
 #!/usr/bin/env python3
 
 from datetime import datetime
+from . import sparkline
+
 import matplotlib
 matplotlib.use("Agg") # noqa
 import matplotlib.pyplot as plt
@@ -100,6 +102,39 @@ class EventLogger:
         log.debug("exit save()")
         return filename
 
+    def text(self, category=None, width=60):
+        log.debug("text(category=%s, width=%d)" % (category, width))
+
+        if not self.eventlog:
+            log.warning("event log is empty")
+            return None
+
+        categories = self.eventlog.keys()
+        if category:
+            if category not in self.eventlog:
+                log.warning("category '%s' not found" % category)
+                return None
+            categories = [category]
+
+        start_date = min(self.eventlog[cat][0] for cat in categories)
+        end_date = max(self.eventlog[cat][-1] for cat in categories)
+        label_width = max(len(cat) for cat in categories)
+
+        text = 'event  %s - %s' % (
+            start_date.strftime(sparkline.DATETIME_FORMAT),
+            end_date.strftime(sparkline.DATETIME_FORMAT))
+        for cat in categories:
+            counts = sparkline.count_events(self.eventlog[cat],
+                                            start_date, end_date, width)
+            line = ''.join(' ' if c == 0 else
+                           sparkline.BLOCKS[min(c, len(sparkline.BLOCKS))-1]
+                           for c in counts)
+            text += '\n%s  %s  %d' % (cat.ljust(label_width), line,
+                                      len(self.eventlog[cat]))
+
+        log.debug("exit text()")
+        return text
+
 
 if __name__ == '__main__':
     import time
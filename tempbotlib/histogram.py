@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+
+import math
+import time
+from datetime import datetime
+
+import numpy as np
+import matplotlib
+matplotlib.use("Agg") # noqa
+import matplotlib.pyplot as plt
+import matplotlib.dates as mdates
+
+import logging
+log = logging.getLogger(__name__)
+
+
+def bucket_bounds(lowest=0.5, highest=30000.0, steps=4):
+    """
+    upper bounds of log buckets, the last one catches everything above
+    """
+    n = int(math.ceil(math.log2(highest/lowest)*steps)) + 1
+    bounds = lowest * 2.0**(np.arange(n)/steps)
+    bounds[-1] = math.inf
+    return bounds
+
+
+def count_buckets(values, bounds):
+    """
+    number of values in each bucket of bounds
+    """
+    indexes = np.searchsorted(bounds, np.asarray(values, dtype=np.float64))
+    return np.bincount(indexes, minlength=len(bounds))
+
+
+class LatencyHistogram:
+    """
+    latency counts in log buckets for a ring of time slots
+    """
+
+    def __init__(self, slot=300, slots=288,
+                 lowest=0.5, highest=30000.0, steps=4):
+        log.debug("__init__(slot=%d, slots=%d)" % (slot, slots))
+        self.slot = slot  # [sec]
+        self.slots = slots
+        self.lowest = lowest  # [ms]
+        self.steps = steps  # buckets per doubling
+        self.bounds = bucket_bounds(lowest, highest, steps)
+        self.counts = np.zeros((slots, len(self.bounds)), dtype=np.uint32)
+        self.epochs = np.full(slots, -1, dtype=np.int64)
+
+    def bucket(self, value):
+        if value <= self.lowest:
+            return 0
+        n = int(math.ceil(math.log2(value/self.lowest)*self.steps))
+        return min(n, len(self.bounds) - 1)
+
+    def record(self, value, now=None):
+        if now is None:
+            now = time.time()
+        epoch = int(now // self.slot)
+        i = epoch % self.slots
+        if self.epochs[i] != epoch:
+            self.counts[i] = 0
+            self.epochs[i] = epoch
+        self.counts[i, self.bucket(value)] += 1
+
+    def window(self, seconds, now=None):
+        """
+        slot indexes covering the last 'seconds' in chronological order
+        """
+        if now is None:
+            now = time.time()
+        last = int(now // self.slot)
+        n = min(int(math.ceil(seconds/self.slot)), self.slots)
+        epochs = np.arange(last - n + 1, last + 1)
+        indexes = epochs % self.slots
+        valid = self.epochs[indexes] == epochs
+        return epochs[valid], indexes[valid]
+
+    def quantile(self, counts, p):
+        total = counts.sum()
+        if total == 0:
+            return None
+        n = int(np.searchsorted(np.cumsum(counts), total*p/100.0))
+        if n >= len(self.bounds) - 1:
+            return float(self.bounds[-2])
+        return float(self.bounds[n])
+
+    def percentiles(self, ps=(50, 95, 99), seconds=3600, now=None):
+        epochs, indexes = self.window(seconds, now)
+        counts = self.counts[indexes].sum(axis=0)
+        return [self.quantile(counts, p) for p in ps], int(counts.sum())
+
+    def series(self, p=50, seconds=86400, now=None):
+        epochs, indexes = self.window(seconds, now)
+        times = [datetime.fromtimestamp(e*self.slot) for e in epochs]
+        values = [self.quantile(self.counts[i], p) for i in indexes]
+        return times, values
+
+
+def save_histograms(histograms, filename="latency.png", title="latency",
+                    seconds=86400):
+    log.debug("save_histograms(filename=%s, title=%s)" % (filename, title))
+    color_map = ['#00a0e9', '#e4007f', '#009944', '#f39800', '#0068b7']
+    current_color = 0
+    outfile = None
+
+    fig = plt.figure(figsize=(15, 4))
+    ax = fig.add_subplot(1, 1, 1)
+
+    now = time.time()
+    for name in histograms:
+        times, p50 = histograms[name].series(50, seconds, now)
+        if len(times) < 2:
+            log.info('skip latency plot because %s has too few data(%d)' %
+                     (name, len(times)))
+            continue
+        times, p95 = histograms[name].series(95, seconds, now)
+
+        c = color_map[current_color]
+        ax.plot(times, [np.nan if v is None else v for v in p50],
+                c=c, alpha=1.0, label=name)
+        ax.plot(times, [np.nan if v is None else v for v in p95],
+                c=c, alpha=0.4, linestyle='dotted')
+        outfile = filename
+
+        current_color += 1
+        if current_color >= len(color_map):
+            current_color = 0
+
+    if outfile:
+        ax.set_title(title + " (p50, p95)")
+        ax.set_ylabel("ms")
+        ax.set_yscale('log')
+        ax.xaxis.set_major_formatter(mdates.DateFormatter('%b %d\n%H:%M'))
+        ax.grid()
+        ax.legend(loc='upper left', frameon=False)
+
+        ax.tick_params(left=False, bottom=False)
+        ax.spines['top'].set_visible(False)
+        ax.spines['left'].set_visible(False)
+        ax.spines['right'].set_visible(False)
+
+        plt.savefig(filename, transparent=False, bbox_inches='tight')
+
+    plt.close(fig)
+    log.debug("exit save_histograms()")
+    return outfile
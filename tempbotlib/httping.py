@@ -1,16 +1,38 @@
 #!/usr/bin/env python3
 
+import http.client
+import socket
+import ssl
+from threading import Lock
+from urllib.parse import urljoin, urlsplit
 import requests
 import time
 
+import logging
+log = logging.getLogger(__name__)
+
+REDIRECT_CODES = (301, 302, 303, 307, 308)
+MAX_REDIRECTS = 5
+
+# idle keep-alive connections shared by all servers on the same host
+connection_pool = {}
+connection_pool_lock = Lock()
+
+
+def elapsed(t1):
+    return (time.monotonic() - t1)*1000.0  # [ms]
+
 
 class Server:
     down = 1
     up = 2
 
-    def __init__(self, url):
+    def __init__(self, url, method='GET'):
         self.url = url
+        self.method = method.upper()
         self.timeout = 3
+        self.rtt = None  # [ms] of the last response
+        self.timings = {}
         self.server_status = self.down
         if self.get_status() == 200:
             self.server_status = self.up
@@ -25,7 +47,12 @@ class Server:
         return alive, response
 
     def get_status(self):
+        if self.method != 'GET':
+            return self.probe()
+
         status_code = -1
+        self.rtt = None
+        t1 = time.monotonic()
         try:
             response = requests.get(self.url, timeout=self.timeout)
         except (requests.exceptions.ConnectionError,
@@ -33,9 +60,145 @@ class Server:
             status_code = 500
         else:
             status_code = response.status_code
+            self.rtt = elapsed(t1)
+        self.timings = {'total': self.rtt}
 
         return status_code
 
+    def probe(self):
+        """
+        HEAD, or GET closed after the status line, over a reused connection.
+        redirects are followed as requests.get() does in GET mode
+        """
+        log.debug("probe(%s)" % self.url)
+        target = self.url
+        total = 0.0
+        for n in range(MAX_REDIRECTS + 1):
+            status_code, location = self.fetch(target)
+            if self.rtt is None:
+                break
+            total += self.rtt
+            if status_code not in REDIRECT_CODES or not location:
+                break
+            target = urljoin(target, location)
+            log.debug("redirect to %s" % target)
+
+        if self.rtt is not None:
+            self.rtt = total
+            self.timings['total'] = total
+        log.debug("exit probe(): %d %s" % (status_code, self.timings))
+        return status_code
+
+    def fetch(self, target):
+        """
+        (status code, Location header) of one request to target
+        """
+        url = urlsplit(target)
+        path = url.path or '/'
+        if url.query:
+            path += '?' + url.query
+        key = (url.scheme, url.hostname, url.port)
+
+        self.rtt = None
+        self.timings = {}
+        status_code = 500
+        location = None
+        retry = 2
+        while retry > 0:
+            retry -= 1
+            timings = {'dns': None, 'connect': None, 'tls': None}
+            t1 = time.monotonic()
+            connection = None
+            try:
+                with connection_pool_lock:
+                    idle = connection_pool.get(key, [])
+                    if idle:
+                        connection = idle.pop()
+                reused = connection is not None
+                if not reused:
+                    connection = self.connect(url, timings)
+                status_code, keep_alive, location = self.request(
+                    connection, path, timings)
+            except (OSError, http.client.HTTPException) as e:
+                log.debug("%s: %s" % (target, e))
+                status_code = 500
+                if connection:
+                    connection.close()
+                if reused:
+                    continue  # stale keep-alive connection
+                break
+
+            timings['total'] = elapsed(t1)
+            if keep_alive:
+                with connection_pool_lock:
+                    connection_pool.setdefault(key, []).append(connection)
+            else:
+                connection.close()
+
+            if status_code in (405, 501) and self.method == 'HEAD':
+                log.info("%s does not allow HEAD" % target)
+                self.method = 'STREAM'
+                retry = 1
+                continue
+
+            self.timings = timings
+            self.rtt = timings['total']
+            break
+
+        return status_code, location
+
+    def connect(self, url, timings):
+        if url.scheme == 'https':
+            port = url.port or 443
+        else:
+            port = url.port or 80
+
+        t1 = time.monotonic()
+        addrinfo = socket.getaddrinfo(url.hostname, port,
+                                      type=socket.SOCK_STREAM)
+        timings['dns'] = elapsed(t1)
+
+        t1 = time.monotonic()
+        sock = socket.create_connection(addrinfo[0][4][:2],
+                                        timeout=self.timeout)
+        timings['connect'] = elapsed(t1)
+
+        if url.scheme == 'https':
+            t1 = time.monotonic()
+            try:
+                context = ssl.create_default_context()
+                sock = context.wrap_socket(sock, server_hostname=url.hostname)
+            except (OSError, ssl.SSLError):
+                sock.close()
+                raise
+            timings['tls'] = elapsed(t1)
+            connection = http.client.HTTPSConnection(url.hostname, port,
+                                                     timeout=self.timeout)
+        else:
+            connection = http.client.HTTPConnection(url.hostname, port,
+                                                    timeout=self.timeout)
+        connection.sock = sock
+        return connection
+
+    def request(self, connection, path, timings):
+        t1 = time.monotonic()
+        if self.method == 'STREAM':
+            connection.request('GET', path)
+        else:
+            connection.request(self.method, path,
+                               headers={'Connection': 'keep-alive'})
+        response = connection.getresponse()
+        timings['first_byte'] = elapsed(t1)
+
+        location = response.getheader('Location')
+        if self.method == 'STREAM':
+            # do not download the body
+            response.close()
+            return response.status, False, location
+
+        response.read()
+        return response.status, not response.will_close, location
+
 
 if __name__ == "__main__":
     urls = [
@@ -44,8 +207,8 @@ if __name__ == "__main__":
     ]
     servers = []
     for server in urls:
-        servers.append(Server(server))
+        servers.append(Server(server, method='HEAD'))
     while (True):
         for server in servers:
-            print(server.url, server.is_alive())
+            print(server.url, server.is_alive(), server.timings)
         time.sleep(60)
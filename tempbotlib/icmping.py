@@ -1,10 +1,23 @@
 #!/usr/bin/env python3
 
+import math
+import os
+import random
+import re
+import select
+import socket
+import struct
 import time
 from datetime import datetime
 import subprocess
 from threading import Thread
 
+from . import histogram as hg
+from . import sparkline
+from .ringbuffer import RingBuffer
+
+import numpy as np
+
 import matplotlib
 matplotlib.use("Agg") # noqa
 import matplotlib.pyplot as plt
@@ -14,32 +27,348 @@ import logging
 log = logging.getLogger(__name__)
 
 
+ICMP_ECHO_REQUEST = 8
+ICMP_ECHO_REPLY = 0
+
+# ping(8) output
+RE_REPLY = re.compile(r'icmp_seq=(\d+).* time=([\d.]+) ms')
+RE_LOSS = re.compile(r'(\d+) packets transmitted, (\d+) (?:packets )?received'
+                     r'.*?([\d.]+)% packet loss')
+RE_RTT = re.compile(r'= ([\d.]+)/([\d.]+)/([\d.]+)(?:/([\d.]+))? ms')
+
+COLUMNS = ['min', 'avg', 'max', 'mdev', 'loss']
+PLOT_COLUMNS = ['datetime', 'avg', 'min', 'max', 'loss']
+HEATMAP_COLUMNS = ['datetime', 'buckets', 'loss']
+BUCKETS = hg.bucket_bounds()  # [ms] latency buckets of the heatmap
+ECHO_INTERVAL = 1.0  # [sec] between the requests to a host, as ping(8)
+ECHO_TIMEOUT = 1.0  # [sec] for the replies to the last requests
+
+
 class PingError(Exception):
     pass
 
 
+def checksum(data):
+    if len(data) % 2:
+        data += b'\x00'
+    total = sum(struct.unpack('!%dH' % (len(data)//2), data))
+    total = (total >> 16) + (total & 0xffff)
+    total += total >> 16
+    return ~total & 0xffff
+
+
+def make_echo_request(ident, seq, size=56):
+    payload = os.urandom(size)
+    header = struct.pack('!BBHHH', ICMP_ECHO_REQUEST, 0, 0, ident, seq)
+    header = struct.pack('!BBHHH', ICMP_ECHO_REQUEST, 0,
+                         checksum(header + payload), ident, seq)
+    return header + payload
+
+
+def parse_echo_reply(data, raw):
+    """
+    (identifier, sequence) of an echo reply or None
+    """
+    if raw:
+        data = data[(data[0] & 0x0f)*4:]  # skip IP header
+    if len(data) < 8:
+        return None
+    icmp_type, code, _, ident, seq = struct.unpack('!BBHHH', data[:8])
+    if icmp_type != ICMP_ECHO_REPLY:
+        return None
+    return ident, seq
+
+
+def open_socket():
+    """
+    unprivileged ICMP socket on Linux, raw socket otherwise.
+    returns (socket, is_raw)
+    """
+    try:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM,
+                             socket.IPPROTO_ICMP)
+        return sock, False
+    except OSError as e:
+        log.debug("ICMP datagram socket: %s" % e)
+    sock = socket.socket(socket.AF_INET, socket.SOCK_RAW, socket.IPPROTO_ICMP)
+    return sock, True
+
+
+def socket_available():
+    try:
+        sock, raw = open_socket()
+    except OSError as e:
+        log.info("ICMP socket is not available: %s" % e)
+        return False
+    sock.close()
+    return True
+
+
+def echo(address, count=3, interval=1.0, timeout=1.0):
+    """
+    send 'count' echo requests and return RTTs [ms]. None if lost
+    """
+    return echo_hosts([address], count=count, interval=interval,
+                      timeout=timeout)[0]
+
+
+def echo_hosts(addresses, count=3, interval=1.0, spacing=0.01, timeout=1.0,
+               starts=None, errors=None):
+    """
+    send 'count' echo requests to every address over one socket. the
+    requests of address i start i*spacing late and are 'interval' apart.
+    returns RTTs [ms] for each address. None if lost. 'starts' gets the
+    time.monotonic() of the first request to each address, 'errors' the
+    last send error of each address. a failed send is a lost request,
+    only an error of the socket itself is raised
+    """
+    sock, raw = open_socket()
+    # a datagram socket gets the identifier rewritten to its local port
+    ident = random.randrange(0x10000)
+    seq = random.randrange(0x10000)
+    pending = {}
+    rtts = [[None]*count for address in addresses]
+
+    def receive(deadline):
+        while True:
+            remain = deadline - time.monotonic()
+            if remain <= 0:
+                break
+            readable, _, _ = select.select([sock], [], [], remain)
+            if not readable:
+                break
+            data, addr = sock.recvfrom(2048)
+            t = time.monotonic()
+            reply = parse_echo_reply(data, raw)
+            if not reply or reply[0] != ident or reply[1] not in pending:
+                continue
+            i, n, sent = pending[reply[1]]
+            if addr[0] != addresses[i]:
+                continue
+            del pending[reply[1]]
+            rtts[i][n] = (t - sent)*1000.0
+
+    if starts is not None:
+        starts[:] = [None]*len(addresses)
+    if errors is not None:
+        errors[:] = [None]*len(addresses)
+    sends = sorted((i*spacing + n*interval, i, n)
+                   for n in range(count) for i in range(len(addresses)))
+    start = time.monotonic()
+    try:
+        for offset, i, n in sends:
+            receive(start + offset)
+            sent = time.monotonic()
+            pending[seq] = (i, n, sent)
+            try:
+                sock.sendto(make_echo_request(ident, seq), (addresses[i], 0))
+            except OSError as e:
+                # e.g. no route to this host, the others are still sent
+                log.debug("echo_hosts(): %s: %s" % (addresses[i], e))
+                del pending[seq]
+                if errors is not None:
+                    errors[i] = str(e)
+            if not raw:
+                ident = sock.getsockname()[1]
+            seq = (seq + 1) & 0xffff
+            if starts is not None and n == 0:
+                starts[i] = sent
+        receive(time.monotonic() + timeout)
+    finally:
+        sock.close()
+
+    return rtts
+
+
+def summarize(rtts, sent=None):
+    """
+    statistics of one round. None in rtts is a lost reply
+    """
+    received = [rtt for rtt in rtts if rtt is not None]
+    if sent is None:
+        sent = len(rtts)
+    sample = {'rtts': received, 'loss': None,
+              'min': None, 'avg': None, 'max': None, 'mdev': None}
+    if sent > 0:
+        sample['loss'] = 100.0*(sent - len(received))/sent
+    if received:
+        avg = sum(received)/len(received)
+        var = sum(rtt*rtt for rtt in received)/len(received) - avg*avg
+        sample['min'] = min(received)
+        sample['avg'] = avg
+        sample['max'] = max(received)
+        sample['mdev'] = math.sqrt(max(var, 0.0))
+    return sample
+
+
+def phase_offsets(count, interval):
+    """
+    start offsets [sec] spreading 'count' schedules evenly over 'interval'.
+    the first slot starts half a slot late to stay off the probe rounds
+    started on the tick of the interval
+    """
+    slot = interval / count
+    return [(i + 0.5)*slot for i in range(count)]
+
+
+def sleep_until(deadline, finished):
+    """
+    sleep until time.monotonic() reaches deadline. False if finished()
+    """
+    while not finished():
+        remain = deadline - time.monotonic()
+        if remain <= 0:
+            return True
+        time.sleep(min(remain, 1.0))
+    return False
+
+
+def schedule_spread(servers, interval):
+    """
+    smallest gap [sec] between the last round starts of servers on the
+    circle of 'interval'. None until every server has pinged
+    """
+    starts = [server.round_start for server in servers]
+    if len(starts) < 2 or None in starts:
+        return None
+    phases = sorted(start % interval for start in starts)
+    gaps = [b - a for a, b in zip(phases, phases[1:])]
+    gaps.append(phases[0] + interval - phases[-1])
+    return min(gaps)
+
+
+class Pinger:
+    """
+    icmp ping to all hosts over one socket in one thread
+    """
+
+    def __init__(self, servers, interval=120, spacing=None, phase=None,
+                 jitter=0.0):
+        log.debug("__init__(servers=%s, interval=%d, spacing=%s)" %
+                  (servers, interval, spacing))
+        self.thread = None
+        self.thread_finish = False
+        for server in servers:
+            if server.engine != 'socket':
+                raise PingError("'%s' does not use socket engine" %
+                                server.host)
+        self.servers = servers
+        self.interval = interval
+        self.count = max(server.count for server in servers)
+        if spacing is None:
+            # spread the hosts evenly over the interval, leaving the
+            # requests and the timeout of the last host before the next round
+            window = interval - self.count*ECHO_INTERVAL - ECHO_TIMEOUT
+            if window <= 0:
+                window = ECHO_INTERVAL  # one sweep
+            spacing = window / len(servers)
+        self.spacing = spacing
+        if phase is None:
+            phase = 0.5*spacing  # off the tick like phase_offsets()
+        self.phase = phase  # [sec] from start() to the first round
+        self.jitter = jitter  # [sec] random shift of each round
+        log.debug("exit __init__()")
+
+    def __del__(self):
+        self.finish()
+
+    def ping_round(self):
+        log.debug("ping_round()")
+        addresses = [server.address for server in self.servers]
+        starts = []
+        errors = []
+        try:
+            rtts = echo_hosts(addresses, count=self.count,
+                              interval=ECHO_INTERVAL, spacing=self.spacing,
+                              timeout=ECHO_TIMEOUT, starts=starts,
+                              errors=errors)
+        except OSError as e:
+            # the socket could not be opened, no host was pinged
+            for server in self.servers:
+                server.add_result(None, str(e))
+        else:
+            for server, server_rtts, start, error in zip(self.servers, rtts,
+                                                         starts, errors):
+                server.round_start = start  # when it was really sent
+                sample = summarize(server_rtts[:server.count])
+                if error is not None and sample['avg'] is None:
+                    server.add_result(sample, error)
+                else:
+                    server.add_result(sample)
+        log.debug("exit ping_round()")
+
+    def ping(self):
+        log.debug("ping()")
+        start = time.monotonic() + self.phase
+        n = 0
+        while sleep_until(start + n*self.interval +
+                          random.uniform(-self.jitter, self.jitter),
+                          lambda: self.thread_finish):
+            self.ping_round()
+            # skip the slots missed by an overrunning round
+            n = max(n + 1,
+                    int((time.monotonic() - start)//self.interval) + 1)
+        log.debug("exit ping()")
+
+    def start(self):
+        log.debug("start()")
+        if self.thread:
+            log.warning("thread is already running")
+            return
+
+        self.thread = Thread(target=self.ping)
+        self.thread_finish = False
+        self.thread.start()
+        log.debug("exit start()")
+
+    def finish(self):
+        log.debug("finish()")
+        if self.thread:
+            self.thread_finish = True
+            self.thread.join()
+            self.thread = None
+        else:
+            log.debug("no running thread")
+        log.debug("exit finish()")
+
+
 class Server:
     """
     icmp ping
     """
 
     def __init__(self, host="www.example.com",
-                 sample_count=20, interval=120, rotate=48):
-        log.debug("__init__(host=%s, sample_count=%d, interval=%d, rotate=%d)"
-                  % (host, sample_count, interval, rotate))
+                 sample_count=20, interval=120, rotate=48, engine='auto'):
+        log.debug("__init__(host=%s, sample_count=%d, interval=%d, rotate=%d, "
+                  "engine=%s)" %
+                  (host, sample_count, interval, rotate, engine))
+        if engine == 'auto':
+            if socket_available():
+                engine = 'socket'
+            else:
+                engine = 'subprocess'
+        if engine not in ('socket', 'subprocess'):
+            raise PingError("unknown engine '{0}'".format(engine))
+        self.engine = engine
+        self.address = None
+        self.error_count = 0
+        self.error_datetime = None
+        self.phase = 0.0  # [sec] from start() to the first round
+        self.jitter = 0.0  # [sec] random shift of each round
+        self.round_start = None  # time.monotonic() of the last round
         self.host = host
         self.count = sample_count
         self.interval = interval
-        self.results = {}
-        self.results['datetime'] = []
-        self.results['min'] = []
-        self.results['avg'] = []
-        self.results['max'] = []
         self.thread = None
-        # self.results['stddev'] = []
         self.thread_finish = False
         self.rotate = rotate*60*60/interval
         log.debug("self.rotate=%d" % self.rotate)
+        columns = {'datetime': 'datetime64[us]'}
+        for key in COLUMNS:
+            columns[key] = np.float64
+        columns['rtts'] = (np.float64, sample_count)  # received RTTs
+        columns['buckets'] = (np.float32, len(BUCKETS))  # RTTs per bucket
+        self.results = RingBuffer(max(int(self.rotate), 2), columns)
 
         # because of checking error, do ping once
         self.onetime_ping()
@@ -50,6 +379,16 @@ class Server:
 
     def onetime_ping(self):
         log.debug("onetime_ping()")
+        if self.engine == 'socket':
+            try:
+                self.address = socket.gethostbyname(self.host)
+                echo(self.address, count=1)
+            except OSError as e:
+                log.warning(e)
+                raise PingError("cannot ping to host '{0}'".format(self.host))
+            log.debug("exit onetime_ping()")
+            return
+
         ping = subprocess.Popen(["ping", "-c", "3", self.host],
                                 stdout=subprocess.PIPE,
                                 stderr=subprocess.PIPE)
@@ -58,63 +397,98 @@ class Server:
             raise PingError("cannot ping to host '{0}'".format(self.host))
         log.debug("exit onetime_ping()")
 
+    def ping_socket(self):
+        """
+        returns (sample or None, error message or None)
+        """
+        log.debug("echo %s x %d" % (self.host, self.count))
+        try:
+            rtts = echo(self.address, count=self.count)
+        except OSError as e:
+            return None, str(e)
+        return summarize(rtts), None
+
+    def ping_subprocess(self):
+        """
+        returns (sample or None, error message or None)
+        """
+        log.debug("ping -c %d %s" % (self.count, self.host))
+        ping = subprocess.Popen(["ping", "-c", str(self.count), self.host],
+                                stdout=subprocess.PIPE,
+                                stderr=subprocess.PIPE)
+        rtts = []
+        sent = self.count
+        loss = None
+        stat = None
+        for line in ping.stdout:
+            line = line.decode('utf-8')
+            reply = RE_REPLY.search(line)
+            if reply:
+                rtts.append(float(reply.group(2)))
+                continue
+            result = RE_LOSS.search(line)
+            if result:
+                sent = int(result.group(1))
+                loss = float(result.group(3))
+                continue
+            result = RE_RTT.search(line)
+            if result:
+                stat = result.groups()
+        error = ping.stderr.read().decode('utf-8')
+        ping.wait()
+        log.debug("ping.returncode(%s)=%d" % (self.host, ping.returncode))
+        if ping.returncode >= 2:
+            return None, error
+
+        sample = summarize(rtts, sent=sent)
+        if loss is not None:
+            sample['loss'] = loss
+        if stat:
+            # the summary line is more precise than each reply
+            for key, value in zip(['min', 'avg', 'max', 'mdev'], stat):
+                if value is not None:
+                    sample[key] = float(value)
+        return sample, None
+
+    def add_result(self, sample, error=None):
+        if sample:
+            buckets = hg.count_buckets(sample['rtts'], BUCKETS)
+            self.results.append(datetime=np.datetime64(datetime.today()),
+                                buckets=buckets, **sample)
+            if sample['avg'] is not None:
+                self.error_count = 0
+                self.error_datetime = None
+        else:
+            self.results.append(datetime=np.datetime64(datetime.today()))
+
+        if error is not None:
+            if self.error_count == 0:
+                today = datetime.today()
+                self.error_datetime = today.strftime('%Y/%m/%d %H:%M:%S')
+                log.warning("cannot ping to host '%s'" % (self.host))
+                log.warning(error)
+            elif self.error_count % 10 == 0:
+                log.warning("cannot ping to host '%s' from %s" %
+                            (self.host, self.error_datetime))
+                log.warning(error)
+            self.error_count += 1
+
     def ping(self):
         log.debug("ping()")
-        error_count = 0
-        error_datetime = None
-        while not self.thread_finish:
-            t1 = datetime.today()
-            log.debug("ping -c %d %s" % (self.count, self.host))
-            ping = subprocess.Popen(["ping", "-c", str(self.count), self.host],
-                                    stdout=subprocess.PIPE,
-                                    stderr=subprocess.PIPE)
-            response, error = ping.communicate()
-            log.debug("ping.returncode(%s)=%d" % (self.host, ping.returncode))
-            if ping.returncode == 0:
-                stat = response.decode('utf-8').split("\n")[-2].split("/")
-                self.results['min'].append(float(stat[-4].split(" ")[-1]))
-                self.results['avg'].append(float(stat[-3]))
-                self.results['max'].append(float(stat[-2]))
-                # self.results['stddev'].append(float(stat[-1].split(" ")[0]))
-                self.results['datetime'].append(datetime.today())
-                error_count = 0
-                error_datetime = None
-            elif ping.returncode == 1:
-                self.results['min'].append(None)
-                self.results['avg'].append(None)
-                self.results['max'].append(None)
-                # self.results['stddev'].append(None)
-                self.results['datetime'].append(datetime.today())
+        start = time.monotonic() + self.phase
+        n = 0
+        while sleep_until(start + n*self.interval +
+                          random.uniform(-self.jitter, self.jitter),
+                          lambda: self.thread_finish):
+            self.round_start = time.monotonic()
+            if self.engine == 'socket':
+                sample, error = self.ping_socket()
             else:
-                self.results['min'].append(None)
-                self.results['avg'].append(None)
-                self.results['max'].append(None)
-                # self.results['stddev'].append(None)
-                self.results['datetime'].append(datetime.today())
-                if error_count == 0:
-                    today = datetime.today()
-                    error_datetime = today.strftime('%Y/%m/%d %H:%M:%S')
-                    log.warning("cannot ping to host '%s'" % (self.host))
-                    log.warning(error.decode('utf-8'))
-                elif error_count % 10 == 0:
-                    log.warning("cannot ping to host '%s' from %s" %
-                                (self.host, error_datetime))
-                    log.warning(error.decode('utf-8'))
-                error_count += 1
-
-            if len(self.results['datetime']) > self.rotate:
-                self.results['min'].pop(0)
-                self.results['avg'].pop(0)
-                self.results['max'].pop(0)
-                # self.results['stddev'].pop(0)
-                self.results['datetime'].pop(0)
-
-            t2 = datetime.today()
-            while (t2 - t1).total_seconds() < self.interval:
-                if self.thread_finish:
-                    break
-                time.sleep(1.0)
-                t2 = datetime.today()
+                sample, error = self.ping_subprocess()
+            self.add_result(sample, error)
+            # skip the slots missed by an overrunning round
+            n = max(n + 1,
+                    int((time.monotonic() - start)//self.interval) + 1)
         log.debug("exit ping()")
 
     def start(self):
@@ -140,45 +514,180 @@ class Server:
 
     def save(self, filename="ping.png", linecolor='#0000ff'):
         log.debug("save(filename=%s, linecolor=%s)" % (filename, linecolor))
-        results_len = len([x for x in self.results['avg'] if x is not None])
+        results_len = self.results.count('avg')
         if results_len < 2:
             log.info('skip traffic plot because %s has too few data(%d)' %
                      (self.host, results_len))
             return None
+        return plot_results(self.host, self.snapshot(), filename=filename,
+                            linecolor=linecolor)
 
-        fig = plt.figure(figsize=(15, 4))
-        ax = fig.add_subplot(1, 1, 1)
-
-        ax.set_xlim(self.results['datetime'][0], self.results['datetime'][-1])
-        m = max(i for i in self.results['max'] if i is not None)
-        if float(m) < 10.0:
-            m = 10.0
-        ax.set_ylim(0.0, int(m/100.0+0.9)*100.0)
-        ax.plot(self.results['datetime'], self.results['avg'],
-                c=linecolor, alpha=1.0)
-        ax.plot(self.results['datetime'], self.results['min'],
-                c=linecolor, alpha=0.4, linestyle='dotted')
-        ax.plot(self.results['datetime'], self.results['max'],
-                c=linecolor, alpha=0.4, linestyle='dotted')
-        ax.set_title("ping to %s" % (self.host))
-        ax.set_ylabel("ms")
-        ax.xaxis.set_major_formatter(mdates.DateFormatter('%b %d\n%H:%M'))
-        ax.grid()
+    def snapshot(self, names=PLOT_COLUMNS):
+        return self.results.snapshot(names, maxima=['max'])
 
-        ax.tick_params(left=False, bottom=False)
-        ax.spines['top'].set_visible(False)
-        ax.spines['left'].set_visible(False)
-        ax.spines['right'].set_visible(False)
+    def save_heatmap(self, filename="ping_heatmap.png"):
+        log.debug("save_heatmap(filename=%s)" % filename)
+        if len(self.results) < 2:
+            log.info('skip heatmap because %s has too few data(%d)' %
+                     (self.host, len(self.results)))
+            return None
+        return plot_heatmap(self.host, self.snapshot(HEATMAP_COLUMNS),
+                            filename=filename)
 
-        plt.savefig(filename, transparent=False, bbox_inches='tight')
-        plt.close(fig)
-        log.debug("exit save()")
-        return filename
+    def text(self, width=60):
+        log.debug("text(width=%d)" % width)
+        results = self.results.snapshot(['datetime', 'avg'])
+        return sparkline.summary("ping to %s" % (self.host),
+                                 results['datetime'].tolist(),
+                                 results['avg'].tolist(), unit='ms',
+                                 width=width)
+
+
+def plot_results(host, results, filename="ping.png", linecolor='#0000ff'):
+    """
+    plot a snapshot of one host. no shared state, runs in a worker process
+    """
+    log.debug("plot_results(host=%s, filename=%s)" % (host, filename))
+    times = results['datetime']
+
+    fig = plt.figure(figsize=(15, 5))
+    grid = fig.add_gridspec(2, 1, height_ratios=[4, 1], hspace=0.1)
+    ax = fig.add_subplot(grid[0])
+    loss_ax = fig.add_subplot(grid[1], sharex=ax)
+
+    ax.set_xlim(times[0], times[-1])
+    m = results['maxima']['max']  # O(1), kept by the ring buffer
+    if m is None or m < 10.0:
+        m = 10.0
+    ax.set_ylim(0.0, int(m/100.0+0.9)*100.0)
+    ax.plot(times, results['avg'], c=linecolor, alpha=1.0)
+    ax.plot(times, results['min'],
+            c=linecolor, alpha=0.4, linestyle='dotted')
+    ax.plot(times, results['max'],
+            c=linecolor, alpha=0.4, linestyle='dotted')
+    ax.set_title("ping to %s" % (host))
+    ax.set_ylabel("ms")
+    ax.grid()
+    ax.tick_params(labelbottom=False)
+
+    loss_ax.fill_between(times, results['loss'], step='mid',
+                         color='#e4007f', alpha=0.6, linewidth=0)
+    loss_ax.set_ylim(0.0, 100.0)
+    loss_ax.set_yticks([0, 50, 100])
+    loss_ax.set_ylabel("% loss")
+    loss_ax.xaxis.set_major_formatter(
+        mdates.DateFormatter('%b %d\n%H:%M'))
+    loss_ax.grid()
+
+    for a in [ax, loss_ax]:
+        a.tick_params(left=False, bottom=False)
+        a.spines['top'].set_visible(False)
+        a.spines['left'].set_visible(False)
+        a.spines['right'].set_visible(False)
+
+    plt.savefig(filename, transparent=False, bbox_inches='tight')
+    plt.close(fig)
+    log.debug("exit plot_results()")
+    return filename
+
+
+def plot_heatmap(host, results, filename="ping_heatmap.png"):
+    """
+    share of replies in each latency bucket per round, from the counters
+    kept by add_result(). no shared state, runs in a worker process
+    """
+    log.debug("plot_heatmap(host=%s, filename=%s)" % (host, filename))
+    times = results['datetime']
+    counts = results['buckets']
+    with np.errstate(invalid='ignore', divide='ignore'):
+        density = counts / counts.sum(axis=1, keepdims=True)
+    density[density == 0] = np.nan  # leave empty buckets blank
+
+    # a round covers the time since the previous one
+    xedges = np.concatenate(([times[0] - (times[1] - times[0])], times))
+    step = BUCKETS[1] / BUCKETS[0]
+    yedges = np.concatenate(([BUCKETS[0] / step], BUCKETS[:-1],
+                             [BUCKETS[-2] * step]))
+    used = np.nonzero(np.nansum(counts, axis=0))[0]
+
+    fig = plt.figure(figsize=(15, 5))
+    grid = fig.add_gridspec(2, 1, height_ratios=[4, 1], hspace=0.1)
+    ax = fig.add_subplot(grid[0])
+    loss_ax = fig.add_subplot(grid[1], sharex=ax)
+
+    mesh = ax.pcolormesh(xedges, yedges, density.T, cmap='viridis',
+                         vmin=0.0, vmax=1.0)
+    ax.set_yscale('log')
+    ax.yaxis.set_major_formatter(matplotlib.ticker.ScalarFormatter())
+    if len(used) > 0:
+        ax.set_ylim(yedges[used[0]], yedges[used[-1] + 1])
+    ax.set_xlim(xedges[0], xedges[-1])
+    ax.set_title("ping to %s" % (host))
+    ax.set_ylabel("ms")
+    ax.tick_params(labelbottom=False)
+    fig.colorbar(mesh, ax=[ax, loss_ax], label="share of replies",
+                 pad=0.01)
+
+    loss_ax.fill_between(times, results['loss'], step='mid',
+                         color='#e4007f', alpha=0.6, linewidth=0)
+    loss_ax.set_ylim(0.0, 100.0)
+    loss_ax.set_yticks([0, 50, 100])
+    loss_ax.set_ylabel("% loss")
+    loss_ax.xaxis.set_major_formatter(
+        mdates.DateFormatter('%b %d\n%H:%M'))
+    loss_ax.grid()
+
+    for a in [ax, loss_ax]:
+        a.tick_params(left=False, bottom=False)
+        a.spines['top'].set_visible(False)
+        a.spines['left'].set_visible(False)
+        a.spines['right'].set_visible(False)
+
+    plt.savefig(filename, transparent=False, bbox_inches='tight')
+    plt.close(fig)
+    log.debug("exit plot_heatmap()")
+    return filename
+
+
+def text_results(servers, width=60):
+    log.debug("text_results(servers=%s, width=%d)" % (servers, width))
+    texts = []
+    for server in servers:
+        text = server.text(width=width)
+        if text:
+            texts.append(text)
+
+    if not texts:
+        return None
+    return '\n'.join(texts)
+
+
+def snapshot_results(servers):
+    """
+    one consistent copy per server while the ping threads keep appending
+    """
+    snapshots = []
+    for server in servers:
+        results_len = server.results.count('avg')
+        if results_len < 2:
+            log.info('skip traffic plot because %s has too few data(%d)' %
+                     (server.host, results_len))
+            continue
+        snapshots.append((server.host, server.snapshot()))
+    return snapshots
 
 
 def save_results(servers, filename="ping.png", title="ping"):
     log.debug("save_results(servers=%s, filename=%s, title=%s)" %
               (servers, filename, title))
+    return plot_all(snapshot_results(servers), filename=filename, title=title)
+
+
+def plot_all(snapshots, filename="ping.png", title="ping"):
+    """
+    plot snapshots of all hosts. no shared state, runs in a worker process
+    """
+    log.debug("plot_all(filename=%s, title=%s)" % (filename, title))
     color_map = ['#00a0e9', '#e4007f', '#009944', '#f39800', '#0068b7']
     current_color = 0
     is_canvas_clean = True
@@ -189,44 +698,31 @@ def save_results(servers, filename="ping.png", title="ping"):
 
     start_date = None
     end_date = None
-    for server in servers:
-        results_len = len([x for x in server.results['avg'] if x is not None])
-        if results_len < 2:
-            log.info('skip traffic plot because %s has too few data(%d)' %
-                     (server.host, results_len))
-            continue
-        if not start_date:
-            start_date = server.results['datetime'][0]
-        else:
-            if start_date > server.results['datetime'][0]:
-                start_date = server.results['datetime'][0]
-
-        if not end_date:
-            end_date = server.results['datetime'][-1]
-        else:
-            if end_date < server.results['datetime'][-1]:
-                end_date = server.results['datetime'][-1]
+    for host, results in snapshots:
+        first = results['datetime'][0]
+        last = results['datetime'][-1]
+        if start_date is None or start_date > first:
+            start_date = first
+        if end_date is None or end_date < last:
+            end_date = last
 
     if start_date != end_date:
         ax.set_xlim(start_date, end_date)
     ax.set_ylim(0, 1000)
 
-    for server in servers:
-        if len([x for x in server.results['avg'] if x is not None]) < 2:
-            continue
-
+    for host, results in snapshots:
         c = color_map[current_color]
-        ax.plot(server.results['datetime'], server.results['avg'],
-                c=c, alpha=1.0)
-        ax.plot(server.results['datetime'], server.results['min'],
+        times = results['datetime']
+        ax.plot(times, results['avg'], c=c, alpha=1.0)
+        ax.plot(times, results['min'],
                 c=c, alpha=0.4, linestyle='dotted')
-        ax.plot(server.results['datetime'], server.results['max'],
+        ax.plot(times, results['max'],
                 c=c, alpha=0.4, linestyle='dotted')
 
-        text_ypos = server.results['avg'][-1]
-        if text_ypos is None:
+        text_ypos = results['avg'][-1]
+        if np.isnan(text_ypos):
             text_ypos = 990.0
-        ax.text(end_date, text_ypos, ' ' + server.host, color=c, va='center')
+        ax.text(end_date, text_ypos, ' ' + host, color=c, va='center')
 
         is_canvas_clean = False
 
@@ -250,7 +746,7 @@ def save_results(servers, filename="ping.png", title="ping"):
         outfile = filename
 
     plt.close(fig)
-    log.debug("exit save_results()")
+    log.debug("exit plot_all()")
     return outfile
 
 
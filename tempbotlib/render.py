@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+
+import os
+import pickle
+import select
+import struct
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from subprocess import PIPE, Popen, TimeoutExpired
+from threading import Lock, Timer
+
+import logging
+log = logging.getLogger(__name__)
+
+# the workers import only this module, not the main script of the bot
+WORKER = 'from tempbotlib.render import main; main()'
+# every result is sent as its length and the pickle
+HEADER = struct.Struct('!Q')
+
+
+class RenderTimeout(Exception):
+    pass
+
+
+def read_exactly(stream, size, deadline):
+    """
+    read 'size' bytes from a pipe, RenderTimeout after 'deadline'
+    """
+    fd = stream.fileno()
+    data = b''
+    while len(data) < size:
+        remain = deadline - time.monotonic()
+        if remain <= 0:
+            raise RenderTimeout('no result in time')
+        readable, _, _ = select.select([fd], [], [], remain)
+        if not readable:
+            raise RenderTimeout('no result in time')
+        chunk = os.read(fd, size - len(data))
+        if not chunk:
+            raise EOFError('worker exited')
+        data += chunk
+    return data
+
+
+class Renderer:
+    """
+    worker processes calling module level functions, started once and
+    kept. unlike a 'spawn' pool, they do not run the main script again,
+    so its polling threads are not started in every worker.
+    a job not done in 'timeout' sec kills its worker, a worker is
+    restarted after 'max_jobs' jobs and all exit after 'idle' sec
+    without a job
+    """
+
+    def __init__(self, workers, timeout=60, max_jobs=100, idle=600):
+        log.debug("__init__(workers=%d, timeout=%s, max_jobs=%d, idle=%s)" %
+                  (workers, timeout, max_jobs, idle))
+        self.workers = workers
+        self.timeout = timeout
+        self.max_jobs = max_jobs
+        self.idle = idle
+        self.processes = [None] * workers
+        self.jobs = [0] * workers  # done by each process
+        self.lock = Lock()
+        self.idle_timer = None
+
+    def __del__(self):
+        self.close()
+
+    def stop(self, n):
+        process = self.processes[n]
+        if process and process.poll() is None:
+            process.stdin.close()  # the worker exits on EOF
+            try:
+                process.wait(timeout=10)
+            except TimeoutExpired:
+                process.kill()
+                process.wait()
+        self.processes[n] = None
+        self.jobs[n] = 0
+
+    def kill(self, n):
+        process = self.processes[n]
+        process.kill()
+        process.wait()
+        self.processes[n] = None
+        self.jobs[n] = 0
+
+    def start(self, n):
+        process = self.processes[n]
+        if process and self.jobs[n] >= self.max_jobs:
+            log.debug("start(%d): %d jobs done" % (n, self.jobs[n]))
+            self.stop(n)
+            process = None
+        if process and process.poll() is None:
+            return process
+        env = dict(os.environ)
+        top = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        env['PYTHONPATH'] = os.pathsep.join(
+            [top] + [p for p in [env.get('PYTHONPATH')] if p])
+        process = Popen([sys.executable, '-c', WORKER],
+                        stdin=PIPE, stdout=PIPE, env=env)
+        log.debug("start(%d): pid %d" % (n, process.pid))
+        self.processes[n] = process
+        self.jobs[n] = 0
+        return process
+
+    def call(self, n, jobs):
+        """
+        run jobs one by one in worker n. None for a failed job
+        """
+        outputs = []
+        for function, args in jobs:
+            process = self.start(n)
+            try:
+                pickle.dump((function, args), process.stdin)
+                process.stdin.flush()
+                deadline = time.monotonic() + self.timeout
+                size, = HEADER.unpack(read_exactly(
+                    process.stdout, HEADER.size, deadline))
+                status, output = pickle.loads(read_exactly(
+                    process.stdout, size, deadline))
+            except Exception as e:
+                log.warning("call(): worker %d: %s" % (n, e))
+                self.kill(n)
+                outputs.append(None)
+                continue
+            self.jobs[n] += 1
+            if status != 'ok':
+                log.warning("call(): %s" % output)
+                output = None
+            outputs.append(output)
+        return outputs
+
+    def map(self, jobs):
+        """
+        jobs: [(function, args)], outputs in the order of jobs
+        """
+        log.debug("map(%d jobs)" % len(jobs))
+        workers = min(self.workers, len(jobs))
+        if workers < 1:
+            return []
+        with self.lock:
+            if self.idle_timer:
+                self.idle_timer.cancel()
+            shares = [jobs[n::workers] for n in range(workers)]
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                results = list(executor.map(self.call, range(workers),
+                                            shares))
+            self.idle_timer = Timer(self.idle, self.close_idle)
+            self.idle_timer.daemon = True
+            self.idle_timer.start()
+        outputs = [None] * len(jobs)
+        for n, result in enumerate(results):
+            outputs[n::workers] = result
+        log.debug("exit map()")
+        return outputs
+
+    def close_idle(self):
+        # a map() started meanwhile keeps the workers
+        if self.lock.acquire(blocking=False):
+            try:
+                log.debug("close_idle()")
+                for n in range(self.workers):
+                    self.stop(n)
+            finally:
+                self.lock.release()
+
+    def close(self):
+        if self.idle_timer:
+            self.idle_timer.cancel()
+        for n in range(self.workers):
+            self.stop(n)
+
+
+def main():
+    # keep stdout for the results, print() of the jobs goes to stderr
+    results = os.fdopen(os.dup(sys.stdout.fileno()), 'wb')
+    os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+    jobs = sys.stdin.buffer
+    while True:
+        try:
+            function, args = pickle.load(jobs)
+        except EOFError:
+            break
+        try:
+            result = ('ok', function(*args))
+        except Exception as e:
+            result = ('error', '%s: %s' % (function.__name__, e))
+        data = pickle.dumps(result)
+        results.write(HEADER.pack(len(data)) + data)
+        results.flush()
@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+
+import time
+from collections import deque
+
+import numpy as np
+
+import logging
+log = logging.getLogger(__name__)
+
+
+def is_missing(value):
+    if np.issubdtype(type(value), np.datetime64):
+        return np.isnat(value)
+    return np.isnan(value)
+
+
+class RingBuffer:
+    """
+    fixed capacity columns. missing values are NaN (NaT for datetime).
+    one writer thread appends while readers take snapshots without locks
+    """
+
+    def __init__(self, capacity, columns):
+        """
+        columns: {name: dtype} or {name: (dtype, width)} for 2D columns
+        """
+        log.debug("__init__(capacity=%d, columns=%s)" % (capacity, columns))
+        self.capacity = capacity
+        self.columns = {}
+        self.missing = {}
+        self.valid = {}
+        self.maxima = {}
+        for name in columns:
+            dtype = columns[name]
+            shape = capacity
+            if type(dtype) is tuple:
+                dtype, width = dtype
+                shape = (capacity, width)
+            if np.issubdtype(np.dtype(dtype), np.datetime64):
+                missing = np.datetime64('NaT')
+            else:
+                missing = np.nan
+            self.columns[name] = np.full(shape, missing, dtype=dtype)
+            self.missing[name] = missing
+            self.valid[name] = 0
+            self.maxima[name] = deque()  # (sequence, value) decreasing
+        self.head = 0  # next slot to write
+        self.length = 0
+        self.written = 0  # number of appended rows
+        self.sequence = 0  # seqlock: odd while a row is being written
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, name):
+        return self.column(name)
+
+    def append(self, **values):
+        """
+        append one row. missing columns become NaN
+        """
+        self.sequence += 1
+        i = self.head
+        evicted = self.length == self.capacity
+        for name in self.columns:
+            column = self.columns[name]
+            if evicted and column.ndim == 1 and not is_missing(column[i]):
+                self.valid[name] -= 1
+            column[i] = self.missing[name]
+            value = values.get(name)
+            if value is None:
+                continue
+            if column.ndim == 2:
+                value = np.asarray(value, dtype=column.dtype)
+                value = value[:column.shape[1]]
+                column[i, :len(value)] = value
+                continue
+            column[i] = value
+            if is_missing(column[i]):
+                continue
+            self.valid[name] += 1
+            if column.dtype.kind == 'f':
+                maxima = self.maxima[name]
+                while maxima and maxima[-1][1] <= column[i]:
+                    maxima.pop()
+                maxima.append((self.written, column[i]))
+
+        self.written += 1
+        self.head = (self.head + 1) % self.capacity
+        if not evicted:
+            self.length += 1
+        oldest = self.written - self.length
+        for maxima in self.maxima.values():
+            while maxima and maxima[0][0] < oldest:
+                maxima.popleft()
+        self.sequence += 1
+
+    def count(self, name):
+        """
+        number of valid values in the column
+        """
+        return self.valid[name]
+
+    def max(self, name):
+        """
+        maximum of valid values in the column or None
+        """
+        if not self.maxima[name]:
+            return None
+        return float(self.maxima[name][0][1])
+
+    def column(self, name):
+        """
+        copy of the column in chronological order
+        """
+        column = self.columns[name]
+        if self.length < self.capacity:
+            return column[:self.length].copy()
+        return np.concatenate((column[self.head:], column[:self.head]))
+
+    def first(self, name):
+        if self.length == 0:
+            return None
+        return self.columns[name][(self.head - self.length) % self.capacity]
+
+    def last(self, name):
+        if self.length == 0:
+            return None
+        return self.columns[name][(self.head - 1) % self.capacity]
+
+    def snapshot(self, names=None, maxima=[]):
+        """
+        consistent copies of columns taken while the writer may append.
+        retries when a row was written during the copy. the running
+        maximum of the 'maxima' columns is in data['maxima']
+        """
+        if names is None:
+            names = list(self.columns.keys())
+        while True:
+            sequence = self.sequence
+            if sequence % 2:
+                time.sleep(0)  # let the writer finish the row
+                continue
+            data = {}
+            for name in names:
+                data[name] = self.column(name)
+            try:
+                peaks = {name: self.max(name) for name in maxima}
+            except IndexError:
+                continue  # the writer emptied the deque
+            if self.sequence == sequence:
+                if maxima:
+                    data['maxima'] = peaks
+                return data
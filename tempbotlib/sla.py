@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+
+import math
+import time
+
+import numpy as np
+
+import logging
+log = logging.getLogger(__name__)
+
+FIELDS = ['up', 'down', 'outages']  # [sec], [sec], number of up -> down
+
+# (slot [sec], slots): a day of minutes, 8 days of hours, a year of days
+TIERS = [(60, 24*60), (60*60, 8*24), (24*60*60, 366)]
+
+
+def format_duration(seconds):
+    """
+    3725 -> '1h 2m'
+    """
+    seconds = int(seconds)
+    units = [('d', 24*60*60), ('h', 60*60), ('m', 60), ('s', 1)]
+    parts = []
+    for unit, size in units:
+        if seconds >= size:
+            parts.append('%d%s' % (seconds // size, unit))
+            seconds %= size
+        if len(parts) == 2:
+            break
+    if not parts:
+        return '0s'
+    return ' '.join(parts)
+
+
+class Counters:
+    """
+    sums of FIELDS for a ring of time slots
+    """
+
+    def __init__(self, slot, slots):
+        self.slot = slot  # [sec]
+        self.slots = slots
+        self.counts = np.zeros((slots, len(FIELDS)), dtype=np.float64)
+        self.epochs = np.full(slots, -1, dtype=np.int64)
+
+    def add(self, field, value, now):
+        epoch = int(now // self.slot)
+        i = epoch % self.slots
+        if self.epochs[i] != epoch:
+            self.counts[i] = 0
+            self.epochs[i] = epoch
+        self.counts[i, FIELDS.index(field)] += value
+
+    def add_span(self, field, t1, t2):
+        """
+        add the seconds from t1 to t2 to the slots they fall in
+        """
+        while t1 < t2:
+            end = min((t1 // self.slot + 1)*self.slot, t2)
+            self.add(field, end - t1, t1)
+            t1 = end
+
+    def window(self, seconds, now):
+        """
+        sums over the slots covering the last 'seconds'
+        """
+        last = int(now // self.slot)
+        n = min(int(math.ceil(seconds/self.slot)), self.slots)
+        epochs = np.arange(last - n + 1, last + 1)
+        indexes = epochs % self.slots
+        valid = self.epochs[indexes] == epochs
+        return self.counts[indexes[valid]].sum(axis=0)
+
+
+class Availability:
+    """
+    up and down time of a server in minute, hour and day slots.
+    the time between two probes counts as the state of the earlier one
+    """
+
+    def __init__(self, max_gap=3600):
+        self.max_gap = max_gap  # [sec] longer gaps are not counted
+        self.tiers = [Counters(slot, slots) for slot, slots in TIERS]
+        self.last = None  # (time, alive) of the last probe
+        self.down_since = None
+
+    def record(self, alive, now=None):
+        if now is None:
+            now = time.time()
+        if self.last:
+            t1, was_alive = self.last
+            if 0 < now - t1 <= self.max_gap:
+                field = 'up' if was_alive else 'down'
+                for tier in self.tiers:
+                    tier.add_span(field, t1, now)
+            if was_alive and not alive:
+                for tier in self.tiers:
+                    tier.add('outages', 1, now)
+        if alive:
+            self.down_since = None
+        elif self.down_since is None:
+            self.down_since = now
+        self.last = (now, alive)
+
+    def report(self, seconds=7*24*60*60, now=None):
+        """
+        (availability [%] or None, up [sec], down [sec], outages)
+        from the finest tier covering 'seconds'
+        """
+        if now is None:
+            now = time.time()
+        tier = self.tiers[-1]
+        for t in self.tiers:
+            if t.slot*(t.slots - 1) >= seconds:
+                tier = t
+                break
+        up, down, outages = [float(v) for v in tier.window(seconds, now)]
+        if up + down <= 0:
+            return None, 0.0, 0.0, 0
+        return up*100.0/(up + down), up, down, int(outages)
+
+
+if __name__ == '__main__':
+    availability = Availability()
+    now = time.time()
+    for i in range(100):
+        availability.record(i % 30 < 27, now + i*60)
+    print(availability.report(now=now + 100*60))
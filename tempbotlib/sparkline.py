@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+
+import math
+
+import logging
+log = logging.getLogger(__name__)
+
+BLOCKS = '▁▂▃▄▅▆▇█'
+DATETIME_FORMAT = '%b %d %H:%M'
+
+
+def is_missing(value):
+    return value is None or (type(value) is float and math.isnan(value))
+
+
+def resample(values, width):
+    """
+    average values into 'width' buckets. empty buckets become None
+    """
+    n = len(values)
+    if n <= width:
+        return [None if is_missing(v) else v for v in values]
+
+    buckets = []
+    for i in range(width):
+        chunk = [v for v in values[i*n//width:(i+1)*n//width]
+                 if not is_missing(v)]
+        if chunk:
+            buckets.append(sum(chunk)/len(chunk))
+        else:
+            buckets.append(None)
+    return buckets
+
+
+def sparkline(values, width=60, lower=None, upper=None):
+    """
+    render values as unicode blocks. None or NaN is rendered as a space
+    """
+    values = resample(values, width)
+    data = [v for v in values if v is not None]
+    if not data:
+        return ' ' * len(values)
+
+    if lower is None:
+        lower = min(data)
+    if upper is None:
+        upper = max(data)
+    span = upper - lower
+
+    line = ''
+    for v in values:
+        if v is None:
+            line += ' '
+        elif span <= 0:
+            line += BLOCKS[len(BLOCKS)//2]
+        else:
+            n = int((v - lower)/span*(len(BLOCKS)-1) + 0.5)
+            line += BLOCKS[min(max(n, 0), len(BLOCKS)-1)]
+    return line
+
+
+def count_events(times, start, end, width=60):
+    """
+    count datetimes into 'width' buckets between start and end
+    """
+    counts = [0] * width
+    span = (end - start).total_seconds()
+    for t in times:
+        if span <= 0:
+            n = width - 1
+        else:
+            n = int((t - start).total_seconds()/span*width)
+        counts[min(max(n, 0), width-1)] += 1
+    return counts
+
+
+def summary(title, time, data, unit='', width=60, fmt='%.1f'):
+    """
+    title, period, sparkline and min/max annotations as text lines
+    """
+    values = [v for v in data if not is_missing(v)]
+    if len(values) < 2:
+        log.info('skip sparkline because %s has too few data(%d)' %
+                 (title, len(values)))
+        return None
+
+    lo = min(values)
+    hi = max(values)
+    text = '%s  %s - %s\n' % (title,
+                              time[0].strftime(DATETIME_FORMAT),
+                              time[-1].strftime(DATETIME_FORMAT))
+    text += '%s  min %s%s max %s%s' % (
+        sparkline(data, width=width), fmt % lo, unit, fmt % hi, unit)
+    return text
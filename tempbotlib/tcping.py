@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+
+import asyncio
+import socket
+import time
+from urllib.parse import urlsplit
+
+import logging
+log = logging.getLogger(__name__)
+
+
+def split_address(address):
+    """
+    'host:port' or '[IPv6 address]:port' to (host, port)
+    """
+    url = urlsplit('//' + address)
+    try:
+        port = url.port
+    except ValueError:
+        port = None
+    if not url.hostname or not port:
+        raise ValueError("'%s' is not 'host:port'" % address)
+    return url.hostname, port
+
+
+class Server:
+    def __init__(self, address='www.example.com:80', timeout=3.0):
+        self.address = address
+        self.host, self.port = split_address(address)
+        self.timeout = timeout
+        self.rtt = None  # [ms] connect time of the last probe
+
+    def is_alive(self):
+        return probe_servers([self], timeout=self.timeout)[0]
+
+    def check(self, answer):
+        if answer == 'Connected':
+            alive = True
+        else:
+            alive = False
+        return alive, answer
+
+    async def connect(self):
+        """
+        time the TCP handshake only, name resolution is not included
+        """
+        loop = asyncio.get_running_loop()
+        try:
+            addrinfo = await loop.getaddrinfo(self.host, self.port,
+                                              type=socket.SOCK_STREAM)
+        except socket.gaierror:
+            return 'Hostname does not exist'
+        family, socktype, proto, _, address = addrinfo[0]
+
+        sock = socket.socket(family, socktype, proto)
+        sock.setblocking(False)
+        t1 = time.monotonic()
+        try:
+            await loop.sock_connect(sock, address)
+        except ConnectionRefusedError:
+            # the host answered with a reset
+            self.rtt = (time.monotonic() - t1)*1000.0
+            return 'Connection refused'
+        except OSError as e:
+            return str(e)
+        finally:
+            sock.close()
+        self.rtt = (time.monotonic() - t1)*1000.0
+        return 'Connected'
+
+
+async def probe(servers, timeout=3.0, rtts=None):
+    """
+    connect to all servers concurrently in one event loop.
+    'rtts' gets the connect time [ms] of each server, None without one
+    """
+    log.debug("probe(%d servers, timeout=%.1f)" % (len(servers), timeout))
+
+    async def connect(server):
+        server.rtt = None
+        try:
+            answer = await asyncio.wait_for(server.connect(), timeout)
+        except asyncio.TimeoutError:
+            answer = 'Request Timeout'
+        return server.check(answer)
+
+    results = await asyncio.gather(*[connect(server) for server in servers])
+    if rtts is not None:
+        rtts[:] = [server.rtt for server in servers]
+    log.debug("exit probe()")
+    return list(results)
+
+
+def probe_servers(servers, timeout=3.0, rtts=None):
+    return asyncio.run(probe(servers, timeout=timeout, rtts=rtts))
+
+
+if __name__ == '__main__':
+    servers = [Server('www.google.com:443'), Server('www.example.com:22')]
+    for server, result in zip(servers, probe_servers(servers)):
+        print(server.address, result, server.rtt)
@@ -9,6 +9,10 @@ from threading import Thread
 import queue
 from .weather import Weather, WeatherError
 from .command import Command
+from . import sparkline
+from .ringbuffer import RingBuffer
+
+import numpy as np
 
 import matplotlib
 matplotlib.use("Agg") # noqa
@@ -95,8 +99,9 @@ class Temperature:
 
         # self.sampleratio
         self.is_hot = False
-        self.tempdata = []
-        self.timedata = []
+        self.plotdata = RingBuffer(self.plot_buffer_size,
+                                   {'time': 'datetime64[us]',
+                                    'temp': np.float64})
         self.temp_sum = 0
         self.temp_n = 0
         self.plot_interval_t1 = None
@@ -175,19 +180,17 @@ class Temperature:
         t2 = datetime.today()
         if (t2 - self.plot_interval_t1).total_seconds() >= self.plot_interval:
             self.plot_interval_t1 = t2
-            if len(self.tempdata) >= self.plot_buffer_size:
-                self.tempdata.pop(0)
-            self.tempdata.append(self.temp_sum/self.temp_n)
-            if len(self.timedata) >= self.plot_buffer_size:
-                self.timedata.pop(0)
-            self.timedata.append(datetime.today())
+            self.plotdata.append(time=np.datetime64(datetime.today()),
+                                 temp=self.temp_sum/self.temp_n)
 
             self.temp_sum = 0
             self.temp_n = 0
         log.debug("exit check_temperature()")
 
     def get_temp_time(self):
-        return self.timedata, self.tempdata
+        # consistent copy while the polling thread keeps appending
+        data = self.plotdata.snapshot()
+        return data['time'].tolist(), data['temp'].tolist()
 
     def polling(self):
         log.debug("polling()")
@@ -360,6 +363,16 @@ def plot_temperature(time, data, pngfile='/tmp/temp.png'):
     return retval
 
 
+def text_temperature(time, data, width=60):
+    if len(data) < 2:
+        log.info('skip temperature text because there are too few data(%d)' %
+                 (len(data)))
+        return None
+
+    return sparkline.summary('temperature', time, data, unit='°C',
+                             width=width)
+
+
 if __name__ == '__main__':
     """
     for debug
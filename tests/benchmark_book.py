@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+"""
+parse the saved honto pages with full trees and with parse_only()
+
+    python3 tests/benchmark_book.py [repeat]
+"""
+
+import os
+import re
+import sys
+import timeit
+import bs4
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+os.environ['BOOK_CONFIG'] = 'tests/book-test.conf'
+os.environ['CALIL_APPKEY'] = 'calil_appkey_dummy'
+import tempbotlib.book as book  # noqa: E402
+
+prefix = 'tests/test_book_response_mock/'
+search_pages = ['imakoko-search.html', 'twiter-search.html']
+detail_pages = [f for f in sorted(os.listdir(prefix))
+                if f.startswith('pd-book')]
+
+
+def full_titles(text):
+    soup = bs4.BeautifulSoup(text, features='html.parser')
+    return [t.string for t in soup.find_all('a', class_='dyTitle')]
+
+
+def strained_titles(text):
+    soup = book.parse_only(text, 'a', class_='dyTitle')
+    return [t.string for t in soup.find_all('a', class_='dyTitle')]
+
+
+def full_isbns(text):
+    isbns = []
+    soup = bs4.BeautifulSoup(text, features='html.parser')
+    for li in soup.find_all('li', string=re.compile('ISBN')):
+        isbn_string = li.string.split(r'：')
+        if len(isbn_string) == 2:
+            isbn = isbn_string[1].split('-')
+            if len(isbn) == 5:
+                isbn.pop(0)
+            isbns.append(''.join(isbn))
+    return isbns
+
+
+def bench(name, old, new, pages, repeat):
+    texts = [open(prefix + page).read() for page in pages]
+    for text in texts:
+        assert old(text) == new(text)
+    t_old = timeit.timeit(lambda: [old(text) for text in texts],
+                          number=repeat)
+    t_new = timeit.timeit(lambda: [new(text) for text in texts],
+                          number=repeat)
+    print('%-12s %3d pages: %7.1f ms -> %7.1f ms (x%.1f)' %
+          (name, len(texts), t_old*1000/repeat, t_new*1000/repeat,
+           t_old/t_new))
+
+
+if __name__ == '__main__':
+    repeat = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    bs = book.BookStatus(None)
+    print('parser: %s' % book.PARSER)
+    bench('search', full_titles, strained_titles, search_pages, repeat)
+    bench('detail', full_isbns, bs.parse_isbn_h, detail_pages, repeat)
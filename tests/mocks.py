@@ -1,3 +1,4 @@
+import io
 import requests
 import dns.resolver
 import time
@@ -68,6 +69,20 @@ rtt min/avg/max/mdev = 547.566/549.391/553.008/2.557 ms
 --- 1.1.1.1 ping statistics ---
 3 packets transmitted, 3 received, 0% packet loss, time 2022ms
 rtt min/avg/max/mdev = 21.786/22.415/23.320/0.655 ms
+""",
+        '1.0.0.1': """PING 1.0.0.1 (1.0.0.1) 56(84) bytes of data.
+64 bytes from 1.0.0.1: icmp_seq=1 ttl=128 time=20.1 ms
+64 bytes from 1.0.0.1: icmp_seq=3 ttl=128 time=24.1 ms
+
+--- 1.0.0.1 ping statistics ---
+3 packets transmitted, 2 received, 33.3333% packet loss, time 2022ms
+rtt min/avg/max/mdev = 20.100/22.100/24.100/2.000 ms
+""",
+        '1.0.0.2': """PING 1.0.0.2 (1.0.0.2) 56(84) bytes of data.
+
+--- 1.0.0.2 ping statistics ---
+3 packets transmitted, 0 received, 100% packet loss, time 2022ms
+
 """
     }
 
@@ -76,19 +91,30 @@ rtt min/avg/max/mdev = 21.786/22.415/23.320/0.655 ms
             self.returncode = returncode
             self.response = response
             self.error = error
+            self.stdout = io.BytesIO(response)
+            self.stderr = io.BytesIO(error)
 
         def communicate(self):
             return (self.response, self.error)
 
+        def wait(self):
+            return self.returncode
+
     ping_command = args[0]
     ping_count = ping_command[2]
     res = response.get(ping_command[3])
     if res:
         res = res.encode()
+        err = b''
         status_code = 0
+        if 'packet loss' in res.decode() and ' 0% packet loss' not in \
+                res.decode():
+            status_code = 1
     else:
-        res = 'ping: %s: Name or service not known' % ping_command[3]
+        res = b''
+        err = ('ping: %s: Name or service not known' %
+               ping_command[3]).encode()
         status_code = 2
     time.sleep(int(ping_count))
-    return MockPing(status_code, res, None)
+    return MockPing(status_code, res, err)
 
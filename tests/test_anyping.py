@@ -1,12 +1,22 @@
 #!/usr/bin/env python3
 
 import time
+import json
 import os
+import re
+import socket
+from threading import Thread
 import pytest
 import tempbotlib.anyping as anyping
 import mocks
 
 
+def dns_probe_mock(servers, timeout=5.0, rtts=None):
+    if rtts is not None:
+        rtts[:] = [None]*len(servers)
+    return [(True, '1.1.1.1')]*len(servers)
+
+
 def test_anyping_init_raise_no_config():
     os.environ['ANYPING_CONFIG'] = ''
     with pytest.raises(anyping.AnypingError):
@@ -68,6 +78,193 @@ def test_anyping_ping(mocker):
         assert message in responses
 
 
+def test_anyping_probe_concurrently(mocker):
+    def slow_requests_mock(*args, **kwargs):
+        time.sleep(2)
+        return mocks.requests_mock(*args, **kwargs)
+
+    mocker.patch('tempbotlib.anyping.dp.probe_servers',
+                 side_effect=dns_probe_mock)
+    mocker.patch('tempbotlib.anyping.hp.requests.get',
+                 side_effect=slow_requests_mock)
+    mocker.patch('tempbotlib.icmping.subprocess.Popen',
+                 side_effect=mocks.popen_mock)
+
+    os.environ['ANYPING_CONFIG'] = 'tests/anyping-test.conf'
+    ap = anyping.Servers()
+    # 3 web servers and one task for the DNS servers
+    assert ap.executor._max_workers == 4
+    for server in ap.servers.values():
+        assert server['server'].timeout <= ap.deadline
+
+    t1 = time.monotonic()
+    results = ap.probe()
+    elapsed = time.monotonic() - t1
+    assert elapsed < 4
+    assert results['https://httpstat.us/200'] == (True, 200)
+    assert results['https://httpstat.us/403'] == (False, 403)
+    assert results['8.8.8.8'] == (True, '1.1.1.1')
+
+    latency = ap.get_latency_of_servers().split('\n')
+    assert '8.8.8.8 (DNS) no samples' in latency
+    assert re.match(r'https://httpstat.us/200 \(Web\) p50 [0-9.]+ '
+                    r'p95 [0-9.]+ p99 [0-9.]+ ms \(2 samples\)', latency[2])
+
+    availability = ap.get_sla_of_servers().split('\n')
+    assert re.match(r'8.8.8.8 \(DNS\) 100.000% up, 0 outages, down 0s of ',
+                    availability[0])
+    assert re.match(r'https://httpstat.us/403 \(Web\) 0.000% up, '
+                    r'0 outages, down [0-9]+s of [0-9]+s, down for ',
+                    availability[3])
+
+    ap.deadline = 1
+    results = ap.probe()
+    assert results['https://httpstat.us/200'] == (
+        False, 'Probe deadline exceeded')
+    # the RTT of the last round is not recorded again
+    latency = ap.get_latency_of_servers().split('\n')
+    assert latency[2].endswith('(2 samples)')
+    ap = None
+
+
+def test_anyping_tcp(mocker, tmp_path):
+    mocker.patch('tempbotlib.anyping.dp.probe_servers',
+                 side_effect=dns_probe_mock)
+    mocker.patch('tempbotlib.anyping.hp.requests.get',
+                 side_effect=mocks.requests_mock)
+    mocker.patch('tempbotlib.icmping.subprocess.Popen',
+                 side_effect=mocks.popen_mock)
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.bind(('127.0.0.1', 0))
+    sock.listen(8)
+    address = '127.0.0.1:%d' % sock.getsockname()[1]
+
+    with open('tests/anyping-test.conf') as f:
+        conf = json.load(f)
+    conf['anyping']['ping_servers'][address] = {'type': 'TCP'}
+    config = tmp_path / 'anyping-tcp.conf'
+    config.write_text(json.dumps(conf))
+    os.environ['ANYPING_CONFIG'] = str(config)
+
+    ap = anyping.Servers()
+    assert ap.servers[address]['status'] == (True, 'Connected')
+    assert ap.servers[address]['alive'] == 1
+
+    sock.close()
+    assert ap.probe([address])[address] == (False, 'Connection refused')
+    ap = None
+
+    conf['anyping']['ping_servers']['127.0.0.1'] = {'type': 'TCP'}
+    config.write_text(json.dumps(conf))
+    with pytest.raises(anyping.AnypingError):
+        anyping.Servers()
+
+
+def test_anyping_get_status_of_servers_cached(mocker):
+    def slow_requests_mock(*args, **kwargs):
+        time.sleep(1)
+        return mocks.requests_mock(*args, **kwargs)
+
+    mocker.patch('tempbotlib.anyping.dp.probe_servers',
+                 side_effect=dns_probe_mock)
+    requests_get = mocker.patch('tempbotlib.anyping.hp.requests.get',
+                                side_effect=slow_requests_mock)
+    mocker.patch('tempbotlib.icmping.subprocess.Popen',
+                 side_effect=mocks.popen_mock)
+
+    os.environ['ANYPING_CONFIG'] = 'tests/anyping-test.conf'
+    ap = anyping.Servers()
+    requests_get.reset_mock()
+
+    messages = ap.get_status_of_servers().split('\n')
+    assert requests_get.call_count == 0
+    assert 'https://httpstat.us/403 (Web) is down: 403' in messages
+    assert re.match(r'\(checked \d+ sec ago\)', messages[-2])
+
+    threads = [Thread(target=ap.get_status_of_servers, args=(0,))
+               for i in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert requests_get.call_count == 3
+    ap = None
+
+
+def test_anyping_schedule(mocker):
+    mocker.patch('tempbotlib.anyping.dp.probe_servers',
+                 side_effect=dns_probe_mock)
+    mocker.patch('tempbotlib.anyping.hp.requests.get',
+                 side_effect=mocks.requests_mock)
+    mocker.patch('tempbotlib.icmping.subprocess.Popen',
+                 side_effect=mocks.popen_mock)
+
+    os.environ['ANYPING_CONFIG'] = 'tests/anyping-test.conf'
+    ap = anyping.Servers()
+    ap.min_interval = 10
+    ap.max_interval = 80
+    ap.flap_window = 100
+    ap.flap_threshold = 4
+    server = 'https://httpstat.us/200'
+    prop = ap.servers[server]
+
+    expected = [
+        (True, 0, 80, ''),
+        (True, 80, 80, ''),
+        (False, 160, 10, ''),
+        (True, 170, 10, ''),
+        (True, 180, 20, ''),
+        (False, 200, 10, ''),
+        (True, 210, 10, server + ' is flapping: 4 changes in 1 min\n'),
+        (True, 220, 20, ''),
+        (True, 400, 40, server + ' stopped flapping: up\n'),
+    ]
+    for alive, now, interval, message in expected:
+        assert ap.schedule(server, alive, now) == message
+        assert prop['interval'] == interval
+        assert prop['next'] == now + interval
+    ap = None
+
+
+def test_anyping_command_probe_schedules(mocker):
+    mocker.patch('tempbotlib.anyping.dp.probe_servers',
+                 side_effect=dns_probe_mock)
+    mocker.patch('tempbotlib.anyping.hp.requests.get',
+                 side_effect=mocks.requests_mock)
+    mocker.patch('tempbotlib.icmping.subprocess.Popen',
+                 side_effect=mocks.popen_mock)
+
+    os.environ['ANYPING_CONFIG'] = 'tests/anyping-test.conf'
+    ap = anyping.Servers()
+    ap.min_interval = 10
+    server = '8.8.8.8'
+    prop = ap.servers[server]
+    prop['next'] = time.monotonic() + 1000
+    for other in ap.servers:
+        ap.servers[other]['next'] = time.monotonic() + 1000
+    assert ap.ping() == ''
+
+    def timeout_mock(servers, timeout=5.0, rtts=None):
+        rtts[:] = [None]*len(servers)
+        return [(False, 'Request Timeout')]*len(servers)
+
+    mocker.patch('tempbotlib.anyping.dp.probe_servers',
+                 side_effect=timeout_mock)
+    results, age = ap.cached_probe(freshness=0)
+    assert results[server] == (False, 'Request Timeout')
+    # the 'ping' command went through the schedule and the alert
+    assert prop['up'] is False
+    assert len(prop['transitions']) == 1
+    assert prop['next'] <= time.monotonic() + 10
+    # both DNS servers timed out in the command probe
+    events = ap.ping()
+    assert '8.8.8.8 (DNS) is down: Request Timeout\n' in events
+    assert '1.1.1.1 (DNS) is down: Request Timeout\n' in events
+    assert ap.ping() == ''
+    ap = None
+
+
 def test_anyping_icmp_raise():
     os.environ['ANYPING_CONFIG'] = 'tests/anyping-test-icmp-error.conf'
     with pytest.raises(anyping.AnypingError):
@@ -85,16 +282,38 @@ def test_anyping_save_icmp_results(mocker):
     os.environ['ANYPING_CONFIG'] = 'tests/anyping-test.conf'
     responses = {'all': 'tests/test_icmp_all.png',
                  'www.example.com': 'tests/test_icmp_0.png',
-                 'www.iana.org': 'tests/test_icmp_1.png'}
+                 'www.iana.org': 'tests/test_icmp_1.png',
+                 'latency': 'tests/test_icmp_latency.png'}
 
     ap = anyping.Servers()
+    ap.render_workers = 2  # in the worker processes
     time.sleep(30)
+    for server in ap.icmp_servers:
+        server.finish()
+    schedule = ap.get_icmp_schedule().split('\n')
+    assert schedule[0].startswith('www.example.com +')
+    assert schedule[2].startswith('spread: ')
     files = ap.save_icmp_results()
-    ap = None
 
     for file in files:
         assert file[0] == responses[file[1]]
 
+    # graphs of hosts without new samples are not rendered again
+    plot_results = mocker.patch('tempbotlib.anyping.ip.plot_results')
+    plot_all = mocker.patch('tempbotlib.anyping.ip.plot_all')
+    assert ap.save_icmp_results() == files
+    plot_results.assert_not_called()
+    plot_all.assert_not_called()
+
+    heatmaps = {'www.example.com': 'tests/test_icmp_0_heatmap.png',
+                'www.iana.org': 'tests/test_icmp_1_heatmap.png'}
+    files = ap.save_icmp_heatmaps()
+    ap = None
+
+    assert len(files) == 2
+    for file in files:
+        assert file[0] == heatmaps[file[1]]
+
 
 def test_anyping_save_icmp_fail(mocker):
     mocker.patch('tempbotlib.anyping.dp.dns.resolver.query',
@@ -114,5 +333,18 @@ def test_anyping_save_icmp_fail(mocker):
     assert len(files) == 0
 
 
+@pytest.mark.parametrize(('text', 'expected'), [
+    ('90s', 90),
+    ('30m', 30*60),
+    ('12h', 12*60*60),
+    ('7d', 7*24*60*60),
+    ('7', None),
+    ('d', None),
+    ('-1d', None),
+])
+def test_anyping_parse_period(text, expected):
+    assert anyping.parse_period(text) == expected
+
+
 if __name__ == '__main__':
     pytest.main(['-v', __file__])
@@ -5,6 +5,7 @@ import os
 import re
 import json
 import queue
+from threading import Event, Lock, Timer
 import pytest
 import tempbotlib.book as book
 import tempbotlib.command as command
@@ -94,12 +95,11 @@ def test_book_search(mocker, bk, channel, expected):
     q = queue.Queue()
     bs = book.BookStatus(q)
 
-    book_command = command.Command(channel=channel)
-    book_command.command = 'book ' + bk
-    result = bs.run(book_command)
-    assert result.message == '"%s"...' % bk
-    result = bs.run(book_command)
-    assert result.message == 'sorry, busy with searching the other book'
+    for i in range(2):
+        book_command = command.Command(channel=channel)
+        book_command.command = 'book ' + bk
+        result = bs.run(book_command)
+        assert result.message == '"%s"...' % bk
 
     timeout = True
     for i in range(30):
@@ -108,10 +108,394 @@ def test_book_search(mocker, bk, channel, expected):
             break
         time.sleep(2)
     assert timeout is False
+    assert bs.workers == []
 
-    status = q.get()
-    assert re.match(expected, status.message)
-    assert channel == status.channel
+    for i in range(2):
+        status = q.get_nowait()
+        assert re.match(expected, status.message)
+        assert channel == status.channel
+
+
+def test_book_queue(mocker):
+    os.environ['BOOK_CONFIG'] = 'tests/book-test.conf'
+    os.environ['CALIL_APPKEY'] = calil_appkey
+    started = []
+    release = {}
+
+    def run_search_mock(job):
+        started.append((job.user, job.book))
+        release[job.book].wait(10)
+
+    q = queue.Queue()
+    bs = book.BookStatus(q)
+    mocker.patch.object(bs, 'run_search', side_effect=run_search_mock)
+    bs.search_workers = 1
+    bs.queue_per_user = 2
+
+    def run(user, title):
+        release[title] = Event()
+        param = command.Command(command='book ' + title, channel='C',
+                                user=user)
+        return bs.run(param).message
+
+    assert run('alice', 'a1') == '"a1"...'
+    while not started:
+        time.sleep(0.01)
+    assert run('alice', 'a2') == '"a2"... (queue position 1)'
+    assert run('alice', 'a3') == '"a3"... (queue position 2)'
+    assert run('alice', 'a4') == 'sorry, too many of your searches are waiting'
+    # bob is not behind all of alice's searches
+    assert run('bob', 'b1') == '"b1"... (queue position 2)'
+
+    param = command.Command(command='book cancel', channel='C', user='bob')
+    assert bs.run(param).message == 'cancelled 1 searches'
+    assert run('bob', 'b2') == '"b2"... (queue position 2)'
+    assert run('carol', 'c1') == '"c1"... (queue position 3)'
+
+    for title in ['a1', 'a2', 'b2', 'c1', 'a3']:
+        release[title].set()
+    for i in range(100):
+        if not bs.searching:
+            break
+        time.sleep(0.1)
+    assert not bs.searching
+    assert started == [('alice', 'a1'), ('alice', 'a2'), ('bob', 'b2'),
+                       ('carol', 'c1'), ('alice', 'a3')]
+    assert bs.workers == []
+
+
+def test_book_single_flight(mocker):
+    os.environ['BOOK_CONFIG'] = 'tests/book-test.conf'
+    os.environ['CALIL_APPKEY'] = calil_appkey
+    release = Event()
+    searched = []
+
+    def get_isbns_mock(title, cancel=None):
+        searched.append(title)
+        release.wait(10)
+        return {}
+
+    q = queue.Queue()
+    bs = book.BookStatus(q)
+    mocker.patch.object(bs, 'get_isbns', side_effect=get_isbns_mock)
+
+    params = []
+    for user, title in [('alice', 'イマココ'), ('bob', ' イマココ'),
+                        ('carol', 'ＩＭＡ'), ('carol', 'ima')]:
+        param = command.Command(command='book ' + title, channel=user,
+                                user=user)
+        bs.run(param)
+        params.append(param)
+    # bob waits for alice's search, carol's second one for her first
+    assert len(bs.inflight) == 2
+
+    param = command.Command(command='book cancel', channel='C', user='bob')
+    assert bs.run(param).message == 'cancelled 1 searches'
+    release.set()
+    for i in range(100):
+        if not bs.searching:
+            break
+        time.sleep(0.1)
+    assert sorted(searched) == ['イマココ', 'ＩＭＡ']
+    replies = []
+    while not q.empty():
+        replies.append(q.get_nowait())
+    assert sorted([param.command for param in replies]) == \
+        ['book ima', 'book イマココ', 'book ＩＭＡ']
+    assert bs.inflight == {}
+
+
+def test_book_fetch_pages(mocker):
+    running = {}
+    peak = {}
+    lock = Lock()
+
+    class MockResponse:
+        status_code = 200
+
+        def __init__(self, text):
+            self.text = text
+
+    def slow_requests_mock(link, **kwargs):
+        host = link.split('/')[2]
+        with lock:
+            running[host] = running.get(host, 0) + 1
+            peak[host] = max(peak.get(host, 0), running[host])
+        time.sleep(0.5)
+        with lock:
+            running[host] -= 1
+        return MockResponse(link)
+
+    mocker.patch('tempbotlib.book.requests.get',
+                 side_effect=slow_requests_mock)
+    os.environ['BOOK_CONFIG'] = 'tests/book-test.conf'
+    os.environ['CALIL_APPKEY'] = calil_appkey
+    bs = book.BookStatus(queue.Queue())
+
+    links = ['https://%s/%d' % (host, n)
+             for n in range(4) for host in ['a.example', 'b.example']]
+    t1 = time.monotonic()
+    pages = bs.fetch_pages(links, lambda text: text.upper())
+    assert time.monotonic() - t1 < 1.5
+    assert pages == [link.upper() for link in links]
+    assert peak == {'a.example': 2, 'b.example': 2}
+
+    assert bs.fetch_pages(links, len,
+                          deadline=time.monotonic() + 0.2) is None
+    bs.abort = True
+    assert bs.fetch_pages(links, len) is None
+
+
+def test_book_search_page_deadline(mocker):
+    timeouts = []
+
+    def hung_requests_mock(link, params=None, timeout=None, **kwargs):
+        timeouts.append(timeout)
+        time.sleep(3)
+
+    mocker.patch('tempbotlib.book.requests.get',
+                 side_effect=hung_requests_mock)
+    os.environ['BOOK_CONFIG'] = 'tests/book-test.conf'
+    os.environ['CALIL_APPKEY'] = calil_appkey
+    bs = book.BookStatus(queue.Queue())
+    bs.fetch_deadline = 1
+
+    t = time.monotonic()
+    assert bs.get_isbn_h('イマココ') is None
+    assert time.monotonic() - t < 2.0
+    assert 0 < timeouts[0] <= 1
+
+    cancel = Event()
+    Timer(0.2, cancel.set).start()
+    t = time.monotonic()
+    assert bs.get_isbn_c('イマココ', cancel=cancel) is None
+    assert time.monotonic() - t < 1.0
+
+
+@pytest.mark.parametrize(('sources', 'first_answer', 'expected'), [
+    (['honto', 'calil'], False,
+     {'4774147321': 'honto', '4152091260': 'honto', '4000000001': 'calil'}),
+    (['calil', 'honto'], False,
+     {'9784774147321': 'calil', '4000000001': 'calil',
+      '4152091260': 'honto'}),
+    (['honto', 'calil'], True,
+     {'4774147321': 'honto', '4152091260': 'honto'}),
+])
+def test_book_get_isbns(mocker, sources, first_answer, expected):
+    calil_started = []
+
+    def honto(bs, book, max_count=5, cancel=None):
+        return {'4774147321': 'honto', '4152091260': 'honto'}
+
+    def calil(bs, book, max_count=5, cancel=None):
+        calil_started.append(time.monotonic())
+        for i in range(20):
+            if cancel.is_set():
+                return None
+            time.sleep(0.1)
+        # the same book as ISBN-13 and with the ISBN-10 check digit
+        return {'9784774147321': 'calil', '477414732X': 'calil',
+                '4000000001': 'calil'}
+
+    mocker.patch('tempbotlib.book.BookStatus.get_isbn_h', honto)
+    mocker.patch('tempbotlib.book.BookStatus.get_isbn_c', calil)
+    os.environ['BOOK_CONFIG'] = 'tests/book-test.conf'
+    os.environ['CALIL_APPKEY'] = calil_appkey
+    bs = book.BookStatus(queue.Queue())
+    bs.sources = sources
+    bs.first_answer = first_answer
+
+    t1 = time.monotonic()
+    isbns = bs.get_isbns('イマココ')
+    if first_answer:
+        # calil is cancelled or not started at all
+        assert time.monotonic() - t1 < 1.0
+    else:
+        assert calil_started[0] - t1 < 0.5  # in parallel
+    assert isbns == expected
+    assert list(isbns.values())[0] == sources[0]
+
+
+@pytest.mark.parametrize(('search', 'expected'), [
+    ({'isbn_cache_ttl': 0}, "'isbn_cache_ttl' is not positive 'float'"),
+    ({'status_cache_ttl': '300'},
+     "'status_cache_ttl' is not positive 'float'"),
+    ({'isbn_cache_size': 0}, "'isbn_cache_size' is not positive 'int'"),
+    ({'status_cache_size': 1.5}, "'status_cache_size' is not positive 'int'"),
+    ({'isbn_cache_save_interval': -1},
+     "'isbn_cache_save_interval' is not 'float'"),
+])
+def test_book_cache_config_raise(tmp_path, search, expected):
+    config = tmp_path / 'book.conf'
+    with open('tests/book-test.conf') as f:
+        conf = json.load(f)
+    conf['book_search'] = search
+    config.write_text(json.dumps(conf))
+    os.environ['BOOK_CONFIG'] = str(config)
+    os.environ['CALIL_APPKEY'] = calil_appkey
+    with pytest.raises(book.BookStatusError) as e:
+        book.BookStatus(queue.Queue())
+    assert str(e.value) == expected
+
+
+def test_book_isbn_cache(mocker, tmp_path):
+    honto = mocker.patch('tempbotlib.book.BookStatus.get_isbn_h',
+                         return_value={'4774147321': 'イマココ'})
+    mocker.patch('tempbotlib.book.BookStatus.get_isbn_c', return_value=None)
+    config = tmp_path / 'book.conf'
+    with open('tests/book-test.conf') as f:
+        conf = json.load(f)
+    conf['book_search'] = {'isbn_cache': str(tmp_path / 'isbn.json')}
+    config.write_text(json.dumps(conf))
+    os.environ['BOOK_CONFIG'] = str(config)
+    os.environ['CALIL_APPKEY'] = calil_appkey
+
+    bs = book.BookStatus(queue.Queue())
+    assert bs.get_isbns('イマココ') == {'4774147321': 'イマココ'}
+    assert bs.get_isbns(' イマココ ') == {'4774147321': 'イマココ'}
+    assert honto.call_count == 1
+
+    # hits survive a restart, other titles still scrape
+    bs = book.BookStatus(queue.Queue())
+    assert bs.get_isbns('イマココ') == {'4774147321': 'イマココ'}
+    bs.get_isbns('ＭＩＣＨＩ')
+    bs.get_isbns('michi')
+    assert honto.call_count == 2
+    assert (bs.isbn_cache.hits, bs.isbn_cache.misses) == (2, 1)
+
+
+def test_book_status_cache(mocker):
+    requested = []
+
+    class MockResponse:
+        status_code = 200
+
+        def __init__(self, data):
+            self.data = data
+
+        def json(self):
+            return self.data
+
+    def calil_mock(url, params=None, **kwargs):
+        isbns = params['isbn'].split(',')
+        systemids = params['systemid'].split(',')
+        requested.append((isbns, systemids))
+        books = {}
+        for isbn in isbns:
+            books[isbn] = {}
+            for systemid in systemids:
+                books[isbn][systemid] = {'status': 'OK', 'reserveurl': isbn,
+                                         'libkey': {systemid: '貸出可'}}
+        return MockResponse({'session': 'x', 'continue': 0, 'books': books})
+
+    mocker.patch('tempbotlib.book.requests.get', side_effect=calil_mock)
+    os.environ['BOOK_CONFIG'] = 'tests/book-test.conf'
+    os.environ['CALIL_APPKEY'] = calil_appkey
+    bs = book.BookStatus(queue.Queue())
+    systemids = ['Tokyo_NDL', 'Tokyo_Pref']
+
+    status = bs.get_book_status({'4774147321': 'a'}, systemids)
+    assert requested == [(['4774147321'], systemids)]
+    assert bs.get_book_status({'4774147321': 'a'},
+                              systemids)['books'] == status['books']
+    assert len(requested) == 1
+
+    # only the stale isbn is checked, the fresh one is merged in
+    status = bs.get_book_status({'4774147321': 'a', '4152091260': 'b'},
+                                systemids)
+    assert requested[1] == (['4152091260'], systemids)
+    assert sorted(status['books'].keys()) == ['4152091260', '4774147321']
+    assert status['books']['4774147321']['Tokyo_Pref']['reserveurl'] == \
+        '4774147321'
+    assert bs.status_cache.hits == 4
+
+
+def test_book_adaptive_polling(mocker):
+    polled = []
+
+    class MockResponse:
+        status_code = 200
+
+        def __init__(self, data):
+            self.data = data
+
+        def json(self):
+            return self.data
+
+    def calil_mock(url, params=None, **kwargs):
+        polled.append(time.monotonic())
+        finished = len(polled) > 4
+        return MockResponse({'session': 'x', 'continue': 0 if finished else 1,
+                             'books': {}})
+
+    mocker.patch('tempbotlib.book.requests.get', side_effect=calil_mock)
+    os.environ['BOOK_CONFIG'] = 'tests/book-test.conf'
+    os.environ['CALIL_APPKEY'] = calil_appkey
+    bs = book.BookStatus(queue.Queue())
+    bs.poll_initial = 0.05
+    bs.poll_max = 0.2
+
+    assert list(zip(range(4), book.poll_delays(0.05, 0.2))) == \
+        [(0, 0.05), (1, 0.1), (2, 0.2), (3, 0.2)]
+    assert bs.check_book_status(['4774147321'], ['Tokyo_NDL'],
+                                timeout=10)['continue'] == 0
+    delays = [t2 - t1 for t1, t2 in zip(polled, polled[1:])]
+    assert delays[0] < 0.1
+    assert delays[-1] >= 0.2
+    assert len(bs.poll_stats) == 1
+    elapsed, polls = bs.poll_stats[0]
+    assert polls == 4
+    assert 0.55 <= elapsed < 2.0
+    assert bs.poll_summary().startswith('1 checks, ')
+
+    # the deadline cuts the last delay short
+    polled.clear()
+    mocker.patch('tempbotlib.book.requests.get',
+                 return_value=MockResponse({'session': 'x', 'continue': 1}))
+    t = time.monotonic()
+    assert bs.check_book_status(['4774147321'], ['Tokyo_NDL'],
+                                timeout=0.3) == []
+    assert time.monotonic() - t < 0.5
+
+    cancel = Event()
+    cancel.set()
+    assert bs.check_book_status(['4774147321'], ['Tokyo_NDL'],
+                                cancel=cancel) == []
+    assert len(bs.poll_stats) == 1
+
+
+def test_book_polling_request_timeout(mocker):
+    timeouts = []
+
+    class MockResponse:
+        status_code = 200
+
+        def json(self):
+            return {'session': 'x', 'continue': 1}
+
+    def calil_mock(url, params=None, timeout=None):
+        # a stalled server answers only the first request
+        timeouts.append(timeout)
+        if len(timeouts) > 1:
+            time.sleep(timeout)
+            raise book.requests.Timeout('read timed out')
+        return MockResponse()
+
+    mocker.patch('tempbotlib.book.requests.get', side_effect=calil_mock)
+    os.environ['BOOK_CONFIG'] = 'tests/book-test.conf'
+    os.environ['CALIL_APPKEY'] = calil_appkey
+    bs = book.BookStatus(queue.Queue())
+    bs.poll_initial = 0.05
+
+    t = time.monotonic()
+    assert bs.check_book_status(['4774147321'], ['Tokyo_NDL'],
+                                timeout=0.5) == []
+    assert time.monotonic() - t < 0.8
+    # every request gets the time left to the deadline
+    assert len(timeouts) == 2
+    assert 0.45 <= timeouts[0] <= 0.5
+    assert book.MIN_REQUEST_TIMEOUT <= timeouts[1] < 0.45
+    assert len(bs.poll_stats) == 0
 
 
 if __name__ == '__main__':
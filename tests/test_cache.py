@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from threading import Event, Thread
+import pytest
+from tempbotlib.cache import Cache, SingleFlight
+
+
+def test_cache_ttl_and_lru():
+    cache = Cache(ttl=60, max_entries=2)
+    cache.put('a', 1, now=0)
+    cache.put('b', 2, now=10)
+    assert cache.get('a', now=20) == 1
+    cache.put('c', 3, now=30)  # evicts 'b', 'a' was used later
+    assert cache.get('b', now=30) is None
+    assert cache.get('a', now=59) == 1
+    assert cache.get('a', now=60) is None  # expired
+    assert cache.get('c', now=60) == 3
+    assert (cache.hits, cache.misses) == (3, 2)
+    assert len(cache) == 1
+    assert cache.stats() == '1 entries, 3 hits, 2 misses'
+
+
+def test_cache_persistent(tmp_path):
+    path = str(tmp_path / 'cache.json')
+    cache = Cache(ttl=3600, path=path)
+    cache.put('イマココ', {'4774147321': 'イマココ'})
+    cache.put('old', [1, 2], now=0)
+
+    cache = Cache(ttl=3600, path=path)
+    assert len(cache) == 1
+    assert cache.get('イマココ') == {'4774147321': 'イマココ'}
+
+    with open(path, 'w') as f:
+        f.write('broken')
+    assert len(Cache(ttl=3600, path=path)) == 0
+
+
+@pytest.mark.parametrize(('kwargs', 'expected'), [
+    ({'ttl': 0}, "'ttl' is not positive 'float'"),
+    ({'ttl': '60'}, "'ttl' is not positive 'float'"),
+    ({'ttl': 60, 'max_entries': 0}, "'max_entries' is not positive 'int'"),
+    ({'ttl': 60, 'max_entries': 1.5}, "'max_entries' is not positive 'int'"),
+    ({'ttl': 60, 'save_interval': -1}, "'save_interval' is not 'float' >= 0"),
+])
+def test_cache_raise(kwargs, expected):
+    with pytest.raises(ValueError) as e:
+        Cache(**kwargs)
+    assert str(e.value) == expected
+
+
+def test_cache_save_interval(mocker, tmp_path):
+    path = str(tmp_path / 'cache.json')
+    cache = Cache(ttl=3600, path=path, save_interval=60)
+    cache.put('a', 1)  # the first change is saved at once
+    cache.put('b', 2)
+    with open(path) as f:
+        assert [key for key, t, value in json.load(f)] == ['a']
+    assert cache.dirty
+    cache.save()
+    with open(path) as f:
+        assert [key for key, t, value in json.load(f)] == ['a', 'b']
+    assert not cache.dirty
+
+    # the file is written without the lock, get() does not wait for it
+    writing = Event()
+    release = Event()
+
+    def slow_dump(entries):
+        writing.set()
+        release.wait(10)
+
+    mocker.patch.object(cache, 'dump', side_effect=slow_dump)
+    cache.save_interval = 0
+    writer = Thread(target=cache.put, args=('c', 3))
+    writer.start()
+    assert writing.wait(10)
+    assert cache.get('a') == 1
+    # the next snapshot waits for the running write
+    second = Thread(target=cache.put, args=('d', 4))
+    second.start()
+    time.sleep(0.1)
+    assert cache.dump.call_count == 1
+    release.set()
+    writer.join()
+    second.join()
+    assert cache.dump.call_count == 2
+    assert [key for key, t, value in cache.dump.call_args[0][0]] == \
+        ['b', 'c', 'a', 'd']
+
+
+def test_cache_single_flight():
+    flights = SingleFlight()
+    calls = []
+    release = Event()
+
+    def slow(n):
+        calls.append(n)
+        release.wait(10)
+        return n
+
+    with ThreadPoolExecutor(max_workers=3) as executor:
+        futures = [executor.submit(flights.do, 'key', lambda: slow(1))]
+        time.sleep(0.1)
+        futures += [executor.submit(flights.do, 'key', lambda: slow(2)),
+                    executor.submit(flights.do, 'other', lambda: slow(3))]
+        time.sleep(0.1)
+        release.set()
+        assert [future.result() for future in futures] == [1, 1, 3]
+    assert sorted(calls) == [1, 3]
+    assert flights.shared == 1
+    assert flights.calls == {}
+
+    # the waiting caller runs it again if the running one was cancelled
+    cancel = Event()
+    release.clear()
+    calls.clear()
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        first = executor.submit(flights.do, 'key', lambda: slow(1),
+                                cancel=cancel)
+        time.sleep(0.1)
+        second = executor.submit(flights.do, 'key', lambda: slow(2))
+        time.sleep(0.1)
+        cancel.set()
+        release.set()
+        assert (first.result(), second.result()) == (1, 2)
+    assert calls == [1, 2]
+
+
+if __name__ == '__main__':
+    pytest.main(['-v', __file__])
@@ -1,10 +1,61 @@
 #!/usr/bin/env python3
 
+import socket
+from threading import Thread
+import dns.flags
+import dns.message
+import dns.rcode
+import dns.rrset
 import pytest
 import tempbotlib.dnsping as dnsping
 import mocks
 
 
+@pytest.fixture
+def nameserver():
+    a_record = {
+        'www.example.com.': '93.184.216.34',
+        'www.example.co.jp.': dns.rcode.NXDOMAIN,
+        'www.google.com.': None,  # no reply
+        'www.iana.org.': '192.0.43.8',  # the first query is lost
+        'big.example.com.': 'TC',
+    }
+    received = {}
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind(('127.0.0.1', 0))
+    sock.settimeout(0.1)
+
+    def serve():
+        while sock.fileno() >= 0:
+            try:
+                data, addr = sock.recvfrom(512)
+            except (socket.timeout, OSError):
+                continue
+            query = dns.message.from_wire(data)
+            name = query.question[0].name.to_text()
+            answer = a_record.get(name)
+            received[name] = received.get(name, 0) + 1
+            if answer is None:
+                continue
+            if name == 'www.iana.org.' and received[name] == 1:
+                continue
+            response = dns.message.make_response(query)
+            if answer == 'TC':
+                response.flags |= dns.flags.TC
+            elif answer == dns.rcode.NXDOMAIN:
+                response.set_rcode(dns.rcode.NXDOMAIN)
+            else:
+                response.answer.append(
+                    dns.rrset.from_text(name, 300, 'IN', 'A', answer))
+            sock.sendto(response.to_wire(), addr)
+
+    thread = Thread(target=serve)
+    thread.start()
+    yield sock.getsockname()[1], received
+    sock.close()
+    thread.join()
+
+
 @pytest.mark.parametrize(('nameserver', 'hostname', 'expected'), [
     ('8.8.8.8', 'www.example.com', (True, '93.184.216.34')),
     ('8.8.8.8', 'www.example.co.jp', (False, 'Hostname does not exist')),
@@ -17,5 +68,36 @@ def test_dnsping_is_alive(mocker, nameserver, hostname, expected):
                                       hostname=hostname).is_alive()
 
 
+def test_dnsping_probe_servers(nameserver):
+    nameserver, received = nameserver
+    servers = [
+        dnsping.Server('127.0.0.1', 'www.example.com', port=nameserver),
+        dnsping.Server('127.0.0.1', 'www.example.co.jp', port=nameserver),
+        dnsping.Server('127.0.0.1', 'www.google.com', port=nameserver),
+    ]
+    results = dnsping.probe_servers(servers, timeout=1.0)
+    assert results == [(True, '93.184.216.34'),
+                       (False, 'Hostname does not exist'),
+                       (False, 'Request Timeout')]
+    assert servers[0].rtt >= 0.0
+    assert servers[1].rtt >= 0.0
+    assert servers[2].rtt is None
+    assert received['www.google.com.'] == 3  # sent again twice
+
+
+def test_dnsping_probe_resend(nameserver):
+    nameserver, received = nameserver
+    servers = [
+        dnsping.Server('127.0.0.1', 'www.iana.org', port=nameserver),
+        dnsping.Server('127.0.0.1', 'big.example.com', port=nameserver),
+    ]
+    results = dnsping.probe_servers(servers, timeout=0.6)
+    assert results == [(True, '192.0.43.8'), (True, 'Truncated response')]
+    assert received == {'www.iana.org.': 2, 'big.example.com.': 1}
+    # the answer may be for either query
+    assert servers[0].rtt is None
+    assert servers[1].rtt >= 0.0
+
+
 if __name__ == '__main__':
     pytest.main(['-v', __file__])
@@ -107,5 +107,22 @@ def test_eventlogger_save():
     assert os.path.isfile(filename) is True
 
 
+def test_eventlogger_text():
+    elog = eventlogger.EventLogger()
+    assert elog.text() is None
+
+    for i in range(3):
+        elog.log('apple')
+    elog.log('banana')
+
+    lines = elog.text(width=10).split('\n')
+    assert lines[0].startswith('event  ')
+    assert lines[1].startswith('apple   ')
+    assert lines[1].endswith('  3')
+    assert lines[2].startswith('banana  ')
+    assert lines[2].endswith('  1')
+    assert elog.text(category='cherry') is None
+
+
 if __name__ == '__main__':
     pytest.main(['-v', __file__])
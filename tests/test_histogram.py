@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+
+import os
+import time
+import pytest
+import tempbotlib.histogram as histogram
+
+
+def test_histogram_percentiles():
+    hist = histogram.LatencyHistogram(slot=60, slots=10)
+    now = 6000.0
+    for i in range(1, 101):
+        hist.record(float(i), now=now)
+
+    (p50, p95, p99), n = hist.percentiles(seconds=60, now=now)
+    assert n == 100
+    assert 50.0 <= p50 <= 50.0*1.2
+    assert 95.0 <= p95 <= 95.0*1.2
+    assert 99.0 <= p99 <= 99.0*1.2
+
+    # above the highest bucket
+    hist.record(100000.0, now=now)
+    assert hist.percentiles(ps=(100,), seconds=60, now=now)[0][0] == \
+        hist.bounds[-2]
+
+
+def test_histogram_count_buckets():
+    hist = histogram.LatencyHistogram()
+    values = [0.1, 0.5, 0.6, 3.0, 3.0, 250.0, 100000.0]
+    counts = histogram.count_buckets(values, hist.bounds)
+    assert len(counts) == len(hist.bounds)
+    assert counts.sum() == len(values)
+    for value in values:
+        assert counts[hist.bucket(value)] > 0
+    assert counts[hist.bucket(3.0)] == 2
+
+
+def test_histogram_rolling_window():
+    hist = histogram.LatencyHistogram(slot=60, slots=10)
+    hist.record(1.0, now=0.0)
+    hist.record(100.0, now=120.0)
+
+    assert hist.percentiles(seconds=60, now=120.0)[1] == 1
+    assert hist.percentiles(seconds=180, now=120.0)[1] == 2
+
+    # the slot of 1.0 ms is reused after slots*slot seconds
+    hist.record(10.0, now=600.0)
+    assert hist.percentiles(seconds=6000, now=600.0)[1] == 2
+    assert hist.counts.shape[0] == 10
+
+    times, values = hist.series(p=50, seconds=6000, now=600.0)
+    assert len(times) == 2
+    assert values[0] >= 100.0
+
+
+def test_histogram_save():
+    filename = 'tests/test_histogram_save.png'
+    if os.path.isfile(filename):
+        os.remove(filename)
+
+    hist = histogram.LatencyHistogram(slot=60, slots=10)
+    assert histogram.save_histograms({'a': hist}, filename=filename) is None
+
+    now = time.time()
+    hist.record(10.0, now=now-60)
+    hist.record(20.0, now=now)
+    assert histogram.save_histograms({'a': hist}, filename=filename) == \
+        filename
+    assert os.path.isfile(filename) is True
+
+
+if __name__ == '__main__':
+    pytest.main(['-v', __file__])
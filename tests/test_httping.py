@@ -1,10 +1,64 @@
 #!/usr/bin/env python3
 
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Thread
 import pytest
 import tempbotlib.httping as httping
 import mocks
 
 
+@pytest.fixture
+def webserver():
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+        requests = []
+
+        def redirect(self):
+            if self.path == '/moved':
+                self.send_response(301)
+                self.send_header('Location', '/')
+            elif self.path == '/loop':
+                self.send_response(302)
+                self.send_header('Location', '/loop')
+            else:
+                return False
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return True
+
+        def do_HEAD(self):
+            self.requests.append(('HEAD', self.path))
+            if self.redirect():
+                return
+            if self.path == '/nohead':
+                self.send_response(405)
+            else:
+                self.send_response(200)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+
+        def do_GET(self):
+            self.requests.append(('GET', self.path))
+            if self.redirect():
+                return
+            body = b'x' * 1000
+            self.send_response(200)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    thread = Thread(target=server.serve_forever)
+    thread.start()
+    yield 'http://127.0.0.1:%d' % server.server_port, Handler.requests
+    server.shutdown()
+    server.server_close()
+    thread.join()
+
+
 @pytest.mark.parametrize(('url', 'expected'), [
     ('https://httpstat.us/200', (True, 200)),
     ('https://httpstat.us/403', (False, 403)),
@@ -16,5 +70,50 @@ def test_httping_is_alive(mocker, url, expected):
     assert expected == httping.Server(url).is_alive()
 
 
+def test_httping_head(webserver):
+    url, requests = webserver
+    server = httping.Server(url + '/', method='HEAD')
+    assert server.timings['connect'] is not None
+    assert server.timings['tls'] is None
+
+    assert server.is_alive() == (True, 200)
+    assert server.timings['connect'] is None  # keep-alive connection
+    assert server.timings['first_byte'] <= server.timings['total']
+    assert server.rtt == server.timings['total']
+    assert requests == [('HEAD', '/'), ('HEAD', '/')]
+
+
+def test_httping_head_not_allowed(webserver):
+    url, requests = webserver
+    server = httping.Server(url + '/nohead', method='HEAD')
+    assert server.is_alive() == (True, 200)
+    assert server.method == 'STREAM'
+    assert requests == [('HEAD', '/nohead'), ('GET', '/nohead'),
+                        ('GET', '/nohead')]
+
+
+@pytest.mark.parametrize('method', ['HEAD', 'STREAM'])
+def test_httping_head_redirect(webserver, method):
+    url, requests = webserver
+    server = httping.Server(url + '/moved', method=method)
+    assert server.server_status == server.up
+    assert server.is_alive() == (True, 200)
+    request = 'HEAD' if method == 'HEAD' else 'GET'
+    assert requests[-2:] == [(request, '/moved'), (request, '/')]
+    assert server.rtt == server.timings['total']
+
+    # gives up after MAX_REDIRECTS redirects
+    server = httping.Server(url + '/loop', method=method)
+    assert server.is_alive() == (False, 302)
+    assert requests.count((request, '/loop')) == \
+        2*(httping.MAX_REDIRECTS + 1)
+
+
+def test_httping_head_connection_error():
+    server = httping.Server('http://127.0.0.1:1/', method='HEAD')
+    assert server.is_alive() == (False, 500)
+    assert server.rtt is None
+
+
 if __name__ == '__main__':
     pytest.main(['-v', __file__])
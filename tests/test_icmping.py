@@ -2,6 +2,8 @@
 
 import time
 import os
+import threading
+import numpy as np
 import pytest
 import tempbotlib.icmping as icmping
 import mocks
@@ -13,9 +15,12 @@ def test_icmping_save(mocker):
     png1 = 'tests/test_icmping_save1.png'
     png2 = 'tests/test_icmping_save2.png'
     pngall = 'tests/test_icmping_save_all.png'
+    pngheatmap = 'tests/test_icmping_heatmap.png'
 
-    ping1 = icmping.Server(host='www.example.com', sample_count=3, interval=5)
-    ping2 = icmping.Server(host='1.1.1.1', sample_count=3, interval=5)
+    ping1 = icmping.Server(host='www.example.com', sample_count=3, interval=5,
+                           engine='subprocess')
+    ping2 = icmping.Server(host='1.1.1.1', sample_count=3, interval=5,
+                           engine='subprocess')
     ping1.start()
     ping2.start()
     time.sleep(20)
@@ -32,15 +37,21 @@ def test_icmping_save(mocker):
         os.remove(pngall)
     outfile_all = icmping.save_results([ping1, ping2], filename=pngall)
 
+    if os.path.isfile(pngheatmap):
+        os.remove(pngheatmap)
+    outfile_heatmap = ping2.save_heatmap(filename=pngheatmap)
+
     ping1.finish()
     ping2.finish()
 
     assert outfile1 == png1
     assert outfile2 == png2
     assert outfile_all == pngall
+    assert outfile_heatmap == pngheatmap
     assert os.path.isfile(png1) is True
     assert os.path.isfile(png2) is True
     assert os.path.isfile(pngall) is True
+    assert os.path.isfile(pngheatmap) is True
 
 
 def test_icmping_too_few_data(mocker):
@@ -50,8 +61,10 @@ def test_icmping_too_few_data(mocker):
     png2 = 'tests/test_icmping_save2.png'
     pngall = 'tests/test_icmping_save_all.png'
 
-    ping1 = icmping.Server(host='www.example.com', sample_count=3, interval=60)
-    ping2 = icmping.Server(host='1.1.1.1', sample_count=3, interval=60)
+    ping1 = icmping.Server(host='www.example.com', sample_count=3, interval=60,
+                           engine='subprocess')
+    ping2 = icmping.Server(host='1.1.1.1', sample_count=3, interval=60,
+                           engine='subprocess')
     ping1.start()
     ping2.start()
     time.sleep(10)
@@ -83,7 +96,176 @@ def test_icmping_exception(mocker):
     mocker.patch('tempbotlib.icmping.subprocess.Popen',
                  side_effect=mocks.popen_mock)
     with pytest.raises(icmping.PingError):
-        icmping.Server(host='wwww.example.com')
+        icmping.Server(host='wwww.example.com', engine='subprocess')
+
+
+@pytest.mark.parametrize(('host', 'expected'), [
+    ('1.1.1.1', {'min': 21.786, 'avg': 22.415, 'max': 23.320,
+                 'mdev': 0.655, 'loss': 0.0, 'rtts': [23.3, 21.7, 22.1]}),
+    ('1.0.0.1', {'min': 20.1, 'avg': 22.1, 'max': 24.1,
+                 'mdev': 2.0, 'loss': 33.3333, 'rtts': [20.1, 24.1]}),
+    ('1.0.0.2', {'min': None, 'avg': None, 'max': None,
+                 'mdev': None, 'loss': 100.0, 'rtts': []}),
+])
+def test_icmping_ping_subprocess(mocker, host, expected):
+    mocker.patch('tempbotlib.icmping.subprocess.Popen',
+                 side_effect=mocks.popen_mock)
+    ping = icmping.Server(host=host, sample_count=3, engine='subprocess')
+    sample, error = ping.ping_subprocess()
+    assert error is None
+    assert sample == expected
+
+    ping.add_result(sample, error)
+    assert len(ping.results) == 1
+    for key in ['min', 'avg', 'max', 'mdev', 'loss']:
+        if expected[key] is None:
+            assert np.isnan(ping.results.last(key))
+        else:
+            assert ping.results.last(key) == expected[key]
+    rtts = ping.results.last('rtts')
+    assert list(rtts[~np.isnan(rtts)]) == expected['rtts']
+    assert ping.results.last('buckets').sum() == len(expected['rtts'])
+
+
+def test_icmping_summarize():
+    sample = icmping.summarize([10.0, None, 20.0, None])
+    assert sample == {'min': 10.0, 'avg': 15.0, 'max': 20.0, 'mdev': 5.0,
+                      'loss': 50.0, 'rtts': [10.0, 20.0]}
+
+
+def test_icmping_socket_exception():
+    if not icmping.socket_available():
+        pytest.skip('ICMP socket is not available')
+    with pytest.raises(icmping.PingError):
+        icmping.Server(host='wwww.example.com.invalid', engine='socket')
+
+
+def test_icmping_echo():
+    if not icmping.socket_available():
+        pytest.skip('ICMP socket is not available')
+    rtts = icmping.echo('127.0.0.1', count=3, interval=0.1)
+    assert len(rtts) == 3
+    for rtt in rtts:
+        assert rtt is not None and rtt >= 0.0
+
+    ping = icmping.Server(host='127.0.0.1', sample_count=2, engine='socket')
+    sample, error = ping.ping_socket()
+    assert error is None
+    assert sample['min'] <= sample['avg'] <= sample['max']
+    assert sample['loss'] == 0.0
+    assert len(sample['rtts']) == 2
+
+
+def test_icmping_pinger():
+    if not icmping.socket_available():
+        pytest.skip('ICMP socket is not available')
+    ping1 = icmping.Server(host='127.0.0.1', sample_count=3, engine='socket')
+    ping2 = icmping.Server(host='127.0.0.2', sample_count=2, engine='socket')
+
+    rtts = icmping.echo_hosts([ping1.address, ping2.address], count=3,
+                              interval=0.1)
+    assert len(rtts) == 2
+    assert None not in rtts[0] + rtts[1]
+
+    pinger = icmping.Pinger([ping1, ping2], interval=5, spacing=0.01)
+    threads = threading.active_count()
+    pinger.start()
+    time.sleep(3)
+    assert threading.active_count() == threads + 1
+    pinger.finish()
+
+    for ping in [ping1, ping2]:
+        assert len(ping.results['avg']) == 1
+        assert ping.results['min'][0] <= ping.results['max'][0]
+
+
+def test_icmping_pinger_spread():
+    if not icmping.socket_available():
+        pytest.skip('ICMP socket is not available')
+    pings = [icmping.Server(host='127.0.0.%d' % (i + 1), sample_count=2,
+                            interval=6, engine='socket') for i in range(2)]
+
+    starts = []
+    icmping.echo_hosts([ping.address for ping in pings], count=1,
+                       spacing=0.2, starts=starts)
+    assert 0.15 <= starts[1] - starts[0] <= 0.3
+
+    # 2 requests and the timeout leave 3 sec of the interval to spread over
+    pinger = icmping.Pinger(pings, interval=6)
+    assert pinger.spacing == 1.5
+    assert pinger.phase == 0.75
+    start = time.monotonic()
+    pinger.start()
+    time.sleep(5)
+    pinger.finish()
+
+    assert 0.7 <= pings[0].round_start - start <= 1.0
+    assert 1.4 <= pings[1].round_start - pings[0].round_start <= 1.6
+    for ping in pings:
+        assert len(ping.results) == 1
+
+
+def test_icmping_pinger_send_error():
+    if not icmping.socket_available():
+        pytest.skip('ICMP socket is not available')
+    # a broadcast address fails in sendto(), the other hosts are pinged
+    addresses = ['127.0.0.1', '255.255.255.255', '127.0.0.2']
+    errors = []
+    rtts = icmping.echo_hosts(addresses, count=2, interval=0.1,
+                              errors=errors)
+    assert rtts[1] == [None, None]
+    assert None not in rtts[0] + rtts[2]
+    assert errors[0] is None and errors[2] is None
+    assert errors[1]
+
+    pings = [icmping.Server(host=address, sample_count=2, engine='socket')
+             for address in addresses]
+    pinger = icmping.Pinger(pings, interval=5, spacing=0.01)
+    pinger.ping_round()
+    assert pings[0].error_count == 0 and pings[2].error_count == 0
+    assert pings[0].results['avg'][0] is not None
+    assert pings[1].error_count == 1
+    assert pings[1].results['loss'][0] == 100.0
+
+
+def test_icmping_phase_offsets():
+    assert icmping.phase_offsets(4, 120) == [15.0, 45.0, 75.0, 105.0]
+    assert icmping.phase_offsets(1, 120) == [60.0]
+
+
+def test_icmping_staggered_start(mocker):
+    mocker.patch('tempbotlib.icmping.subprocess.Popen',
+                 side_effect=mocks.popen_mock)
+    pings = [icmping.Server(host='1.1.1.1', sample_count=3, interval=2,
+                            engine='subprocess') for i in range(2)]
+    assert icmping.schedule_spread(pings, 2) is None
+    for ping, offset in zip(pings, icmping.phase_offsets(2, 2)):
+        ping.phase = offset
+        ping.jitter = 0.1
+        ping.start()
+    time.sleep(3)
+    for ping in pings:
+        ping.finish()
+
+    assert 0.6 <= icmping.schedule_spread(pings, 2) <= 1.0
+    for ping in pings:
+        assert len(ping.results) >= 1
+
+
+def test_icmping_pinger_subprocess(mocker):
+    mocker.patch('tempbotlib.icmping.subprocess.Popen',
+                 side_effect=mocks.popen_mock)
+    ping = icmping.Server(host='1.1.1.1', engine='subprocess')
+    with pytest.raises(icmping.PingError):
+        icmping.Pinger([ping])
+
+
+def test_icmping_checksum():
+    packet = icmping.make_echo_request(0x1234, 1, size=8)
+    assert icmping.checksum(packet) == 0
+    reply = bytes([icmping.ICMP_ECHO_REPLY]) + packet[1:]
+    assert icmping.parse_echo_reply(reply, raw=False) == (0x1234, 1)
+    assert icmping.parse_echo_reply(packet, raw=False) is None
 
 
 if __name__ == '__main__':
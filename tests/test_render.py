@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+
+import math
+import os
+import subprocess
+import sys
+import time
+import pytest
+import tempbotlib.render as render
+
+SCRIPT = '''
+import math
+import time
+from threading import Event, Thread
+import tempbotlib.render as render
+
+with open(%r, 'a') as f:
+    f.write('started\\n')
+
+# a poller like the ones tempbotd.py starts at module level
+finished = Event()
+poller = Thread(target=finished.wait)
+poller.start()
+
+renderer = render.Renderer(2)
+print(renderer.map([(math.sqrt, (n,)) for n in [1, 4, 9]]))
+renderer.close()
+finished.set()
+'''
+
+
+def test_render_map():
+    renderer = render.Renderer(2)
+    jobs = [(math.sqrt, (n,)) for n in [1, 4, -1, 16, 25]]
+    assert renderer.map(jobs) == [1.0, 2.0, None, 4.0, 5.0]
+    pids = [process.pid for process in renderer.processes]
+
+    # the workers are kept for the next request
+    assert renderer.map(jobs[:2]) == [1.0, 2.0]
+    assert [process.pid for process in renderer.processes] == pids
+    renderer.close()
+    assert renderer.processes == [None, None]
+
+
+def test_render_timeout():
+    renderer = render.Renderer(1, timeout=1)
+    start = time.monotonic()
+    jobs = [(time.sleep, (10,)), (math.sqrt, (4,))]
+    # the stuck worker is killed, the next job gets a new one
+    assert renderer.map(jobs) == [None, 2.0]
+    assert time.monotonic() - start < 5
+    renderer.close()
+
+
+def test_render_restart_and_idle():
+    renderer = render.Renderer(1, max_jobs=2, idle=1)
+    jobs = [(math.sqrt, (n,)) for n in [1, 4]]
+    assert renderer.map(jobs) == [1.0, 2.0]
+    pid = renderer.processes[0].pid
+    # the worker is replaced after 2 jobs
+    assert renderer.map(jobs[:1]) == [1.0]
+    assert renderer.processes[0].pid != pid
+    assert renderer.jobs == [1]
+
+    # and exits when there is no job for a while
+    process = renderer.processes[0]
+    time.sleep(2)
+    assert renderer.processes == [None]
+    assert process.poll() is not None
+    assert renderer.map(jobs) == [1.0, 2.0]
+    renderer.close()
+
+
+def test_render_script_with_pollers(tmp_path):
+    marker = str(tmp_path / 'started')
+    script = tmp_path / 'bot.py'
+    script.write_text(SCRIPT % marker)
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.getcwd()
+    result = subprocess.run([sys.executable, str(script)], env=env,
+                            stdout=subprocess.PIPE, timeout=60)
+    assert result.returncode == 0
+    assert result.stdout.decode().strip() == '[1.0, 2.0, 3.0]'
+    # the workers did not run the script again
+    with open(marker) as f:
+        assert f.read() == 'started\n'
+
+
+if __name__ == '__main__':
+    pytest.main(['-v', __file__])
@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+
+from datetime import datetime
+from threading import Thread
+import numpy as np
+import pytest
+from tempbotlib.ringbuffer import RingBuffer
+
+
+def test_ringbuffer_rotate():
+    rb = RingBuffer(3, {'datetime': 'datetime64[us]', 'value': np.float64})
+    expected = [
+        (5.0, [5.0], 1, 5.0),
+        (None, [5.0, None], 1, 5.0),
+        (7.0, [5.0, None, 7.0], 2, 7.0),
+        (1.0, [None, 7.0, 1.0], 2, 7.0),
+        (2.0, [7.0, 1.0, 2.0], 3, 7.0),
+        (None, [1.0, 2.0, None], 2, 2.0),
+        (None, [2.0, None, None], 1, 2.0),
+        (None, [None, None, None], 0, None),
+    ]
+    for value, column, count, maximum in expected:
+        rb.append(datetime=np.datetime64(datetime.today()), value=value)
+        assert [None if np.isnan(v) else v for v in rb['value']] == column
+        assert rb.count('value') == count
+        assert rb.max('value') == maximum
+        assert len(rb) == len(column)
+        assert rb.count('datetime') == len(column)
+    assert rb.first('datetime') < rb.last('datetime')
+
+
+def test_ringbuffer_2d():
+    rb = RingBuffer(2, {'rtts': (np.float64, 3)})
+    assert rb.first('rtts') is None
+    rb.append(rtts=[1.0, 2.0])
+    rb.append(rtts=[1.0, 2.0, 3.0, 4.0])
+    rb.append()
+    rtts = rb['rtts']
+    assert rtts.shape == (2, 3)
+    assert list(rtts[0]) == [1.0, 2.0, 3.0]
+    assert np.isnan(rtts[1]).all()
+
+
+def test_ringbuffer_snapshot():
+    rb = RingBuffer(50, {'a': np.float64, 'b': np.float64})
+    finish = False
+
+    def writer():
+        n = 0
+        while not finish:
+            rb.append(a=float(n), b=float(-n))
+            n += 1
+
+    thread = Thread(target=writer)
+    thread.start()
+    try:
+        for i in range(200):
+            data = rb.snapshot()
+            assert len(data['a']) == len(data['b'])
+            assert (data['a'] == -data['b']).all()
+            assert (np.diff(data['a']) == 1.0).all()
+            data = rb.snapshot(['a'], maxima=['a', 'b'])
+            if len(data['a']):
+                assert data['maxima']['a'] == data['a'].max()
+                assert data['maxima']['b'] == -data['a'].min()
+    finally:
+        finish = True
+        thread.join()
+    assert list(rb.snapshot(['a'])) == ['a']
+
+
+if __name__ == '__main__':
+    pytest.main(['-v', __file__])
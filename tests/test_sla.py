@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+
+import pytest
+import tempbotlib.sla as sla
+
+
+def test_sla_report():
+    availability = sla.Availability()
+    now = 86400.0*1000
+    assert availability.report(now=now) == (None, 0.0, 0.0, 0)
+
+    # up 90 sec, down 30 sec, up 30 sec
+    for t, alive in [(0, True), (30, True), (90, False), (120, True),
+                     (150, True)]:
+        availability.record(alive, now + t)
+    percent, up, down, outages = availability.report(seconds=3600,
+                                                     now=now + 150)
+    assert up == 120.0
+    assert down == 30.0
+    assert outages == 1
+    assert percent == pytest.approx(80.0)
+    assert availability.down_since is None
+
+    availability.record(False, now + 180)
+    availability.record(False, now + 240)
+    assert availability.down_since == now + 180
+    assert availability.report(seconds=3600, now=now + 240)[1:] == \
+        (150.0, 90.0, 2)
+
+
+def test_sla_gap_and_tiers():
+    availability = sla.Availability(max_gap=600)
+    now = 86400.0*1000
+    availability.record(True, now)
+    availability.record(True, now + 300)
+    # the bot was stopped for an hour
+    availability.record(False, now + 300 + 3600)
+    availability.record(False, now + 300 + 3600 + 300)
+    end = now + 300 + 3600 + 300
+
+    # minute slots for a day, hour slots for a week, day slots for a year
+    for seconds in [3*3600, 7*86400, 30*86400]:
+        percent, up, down, outages = availability.report(seconds, end)
+        assert (up, down, outages) == (300.0, 300.0, 1)
+        assert percent == pytest.approx(50.0)
+
+    # spans are split over the slots they fall in
+    minutes = availability.tiers[0]
+    assert minutes.window(60, now + 120)[0] == 60.0
+    assert minutes.window(300, now + 299)[0] == 300.0
+
+
+@pytest.mark.parametrize(('seconds', 'expected'), [
+    (0, '0s'),
+    (59, '59s'),
+    (3725, '1h 2m'),
+    (90061, '1d 1h'),
+])
+def test_sla_format_duration(seconds, expected):
+    assert sla.format_duration(seconds) == expected
+
+
+if __name__ == '__main__':
+    pytest.main(['-v', __file__])
@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+
+import datetime as dt
+from datetime import datetime
+import pytest
+import tempbotlib.sparkline as sparkline
+
+
+@pytest.mark.parametrize(('values', 'expected'), [
+    ([0, 1, 2, 3, 4, 5, 6, 7], '▁▂▃▄▅▆▇█'),
+    ([7, None, 0], '█ ▁'),
+    ([3, 3, 3], '▅▅▅'),
+    ([None, None], '  '),
+])
+def test_sparkline(values, expected):
+    assert sparkline.sparkline(values) == expected
+
+
+def test_sparkline_resample():
+    values = list(range(100))
+    line = sparkline.sparkline(values, width=10)
+    assert len(line) == 10
+    assert line[0] == '▁'
+    assert line[-1] == '█'
+    assert sparkline.resample([1, None, None, 3], 2) == [1, 3]
+    assert sparkline.resample([None, None, 1, 3], 2) == [None, 2]
+
+
+def test_sparkline_count_events():
+    start = datetime(2020, 1, 1)
+    end = start + dt.timedelta(minutes=10)
+    times = [start, start, start + dt.timedelta(minutes=5), end]
+    assert sparkline.count_events(times, start, end, width=2) == [2, 2]
+
+
+def test_sparkline_summary():
+    start = datetime(2020, 1, 1)
+    time = [start + dt.timedelta(minutes=i) for i in range(4)]
+    text = sparkline.summary('temperature', time, [20.0, 21.5, None, 25.0],
+                             unit='°C')
+    assert text == ('temperature  Jan 01 00:00 - Jan 01 00:03\n'
+                    '▁▃ █  min 20.0°C max 25.0°C')
+    assert sparkline.summary('temperature', time[:1], [20.0]) is None
+
+
+if __name__ == '__main__':
+    pytest.main(['-v', __file__])
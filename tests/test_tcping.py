@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+
+import asyncio
+import socket
+import pytest
+import tempbotlib.tcping as tcping
+
+
+@pytest.fixture
+def listener():
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.bind(('127.0.0.1', 0))
+    sock.listen(8)
+    yield sock.getsockname()[1]
+    sock.close()
+
+
+@pytest.fixture
+def closed_port():
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+@pytest.mark.parametrize(('address', 'expected'), [
+    ('www.example.com:22', ('www.example.com', 22)),
+    ('192.0.2.1:5432', ('192.0.2.1', 5432)),
+    ('[2001:db8::1]:25', ('2001:db8::1', 25)),
+])
+def test_tcping_split_address(address, expected):
+    assert tcping.split_address(address) == expected
+
+
+@pytest.mark.parametrize('address', [
+    'www.example.com', 'www.example.com:ssh', ':22',
+])
+def test_tcping_split_address_raise(address):
+    with pytest.raises(ValueError):
+        tcping.Server(address)
+
+
+def test_tcping_is_alive(listener):
+    server = tcping.Server('127.0.0.1:%d' % listener)
+    assert server.is_alive() == (True, 'Connected')
+    assert server.rtt is not None
+
+
+def test_tcping_refused(closed_port):
+    server = tcping.Server('127.0.0.1:%d' % closed_port)
+    assert server.is_alive() == (False, 'Connection refused')
+    assert server.rtt is not None
+
+
+def test_tcping_probe_servers(mocker, listener, closed_port):
+    async def hang(self):
+        await asyncio.sleep(10)
+
+    servers = [tcping.Server('127.0.0.1:%d' % listener),
+               tcping.Server('127.0.0.1:%d' % closed_port),
+               tcping.Server('127.0.0.1:%d' % listener)]
+    results = tcping.probe_servers(servers, timeout=1.0)
+    assert results == [(True, 'Connected'), (False, 'Connection refused'),
+                       (True, 'Connected')]
+
+    mocker.patch('tempbotlib.tcping.Server.connect', hang)
+    results = tcping.probe_servers(servers, timeout=0.2)
+    assert results == [(False, 'Request Timeout')] * 3
+    assert [server.rtt for server in servers] == [None] * 3
+
+
+if __name__ == '__main__':
+    pytest.main(['-v', __file__])